@@ -0,0 +1,69 @@
+# _device_info.py
+#
+# Short-lived cache of the per-device facts every SSH step needs, shared by all jobs.
+#
+# What it does:
+# 1. Loads a device's platform, primary IPv4 and secrets group in ONE query
+# 2. Keeps the result (network driver, host, secrets group) for a short TTL, per device
+#
+# Why we need this:
+# Backup, push and the pipeline each look at device.platform.network_driver,
+# device.primary_ip4.address and device.secrets_group. Unless the device was loaded
+# with select_related, every one of those is its own database query - and each job
+# run (and each bulk device) gets a fresh Device object, so they are asked again.
+#
+# Tuning (environment variable):
+#   DEVICE_INFO_TTL - seconds a device's entry stays valid (default 60, 0 disables)
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+from nautobot.dcim.models import Device
+
+try:
+    _TTL = float(os.environ.get("DEVICE_INFO_TTL", 60))
+except ValueError:
+    _TTL = 60.0
+
+# driver: platform.network_driver (or None), host: primary IPv4 without the mask
+# (or None), secrets_group: the device's SecretsGroup (or None)
+DeviceInfo = namedtuple("DeviceInfo", ["driver", "host", "secrets_group"])
+
+# device.pk -> (expires_at, DeviceInfo)
+_CACHE = {}
+_LOCK = threading.Lock()
+
+
+def device_info(device):
+    """Return the DeviceInfo of a device, from the cache if it is recent enough."""
+    now = time.monotonic()
+    with _LOCK:
+        entry = _CACHE.get(device.pk)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    # One query with the three related rows joined in, instead of one lazy query each
+    row = Device.objects.select_related("platform", "primary_ip4", "secrets_group").get(pk=device.pk)
+    # The *_id columns tell us whether the relation is set - no getattr fallbacks
+    # needed, the related rows themselves were loaded by select_related
+    info = DeviceInfo(
+        row.platform.network_driver if row.platform_id else None,
+        str(row.primary_ip4.address.ip) if row.primary_ip4_id else None,
+        row.secrets_group if row.secrets_group_id else None,
+    )
+
+    if _TTL > 0:
+        with _LOCK:
+            _CACHE[device.pk] = (now + _TTL, info)
+    return info
+
+
+def invalidate(device_pk=None):
+    """Drop the cached entry of one device, or everything if no pk is given."""
+    with _LOCK:
+        if device_pk is None:
+            _CACHE.clear()
+        else:
+            _CACHE.pop(device_pk, None)
@@ -0,0 +1,97 @@
+# _device_state.py
+#
+# Short-lived memory of which access VLAN each port of a device has, shared by all jobs.
+#
+# What it does:
+# 1. The push job records the VLAN of every port it pushed successfully
+# 2. The backup job records the VLANs it sees in the device's "display set" config
+# 3. The push job skips ports whose recorded VLAN already is the one to configure
+#
+# Why we need this:
+# The job hook and the pipeline push a port even if the device already has that
+# VLAN (repeated saves, a bulk run over ports that didn't change). Each such push
+# costs an SSH session, a configure/commit cycle and a commit on the device - for
+# nothing. Entries only live for a few minutes, so changes made directly on the
+# device are noticed again soon (and every backup refreshes them).
+#
+# Tuning (environment variable):
+#   PUSH_STATE_TTL - seconds a recorded VLAN is trusted (default 300, 0 disables)
+
+import os
+import re
+import threading
+import time
+
+try:
+    _TTL = float(os.environ.get("PUSH_STATE_TTL", 300))
+except ValueError:
+    _TTL = 300.0
+
+# One access VLAN line of a Junos "display set" config:
+# set interfaces <name> unit 0 family ethernet-switching vlan members <vlan>
+_VLAN_MEMBER_RE = re.compile(
+    r"^set interfaces (\S+) unit 0 family ethernet-switching vlan members (\S+)\s*$",
+    re.MULTILINE,
+)
+# Its mode line: set interfaces <name> unit 0 family ethernet-switching interface-mode <mode>
+_INTERFACE_MODE_RE = re.compile(
+    r"^set interfaces (\S+) unit 0 family ethernet-switching interface-mode (\S+)\s*$",
+    re.MULTILINE,
+)
+
+# (device.pk, interface name) -> (expires_at, vlan name)
+_STATE = {}
+_LOCK = threading.Lock()
+
+
+def has_vlan(device_pk, interface_name, vlan_name):
+    """True if the port is known (recently) to have exactly this VLAN."""
+    with _LOCK:
+        entry = _STATE.get((device_pk, interface_name))
+    return entry is not None and entry[0] > time.monotonic() and entry[1] == vlan_name
+
+
+def remember(device_pk, vlans):
+    """Record port -> VLAN name pairs (a dict) for a device."""
+    if _TTL <= 0 or not vlans:
+        return
+    expires_at = time.monotonic() + _TTL
+    with _LOCK:
+        for interface_name, vlan_name in vlans.items():
+            _STATE[(device_pk, interface_name)] = (expires_at, vlan_name)
+
+
+def learn_from_set_config(device_pk, config_text):
+    """
+    Record the access VLANs found in a Junos "show configuration | display set" output.
+
+    Only ports with "interface-mode access" and exactly one vlan members line are
+    recorded. Everything else (trunks - often with a single member -, ports without
+    an explicit mode, several members) is forgotten, so it is pushed again next
+    time: the push also sets "interface-mode access".
+    """
+    if _TTL <= 0:
+        return
+    access_ports = {
+        interface_name
+        for interface_name, mode in _INTERFACE_MODE_RE.findall(config_text)
+        if mode == "access"
+    }
+    found = {}
+    for interface_name, vlan_name in _VLAN_MEMBER_RE.findall(config_text):
+        if interface_name not in access_ports:
+            continue
+        # Several members on one port = not a plain access port, don't claim to know it
+        found[interface_name] = None if interface_name in found else vlan_name
+    forget(device_pk)
+    remember(device_pk, {name: vlan for name, vlan in found.items() if vlan is not None})
+
+
+def forget(device_pk=None):
+    """Drop what we know about one device, or everything if no pk is given."""
+    with _LOCK:
+        if device_pk is None:
+            _STATE.clear()
+        else:
+            for key in [k for k in _STATE if k[0] == device_pk]:
+                del _STATE[key]
@@ -0,0 +1,602 @@
+# _git.py
+#
+# Shared Git helpers for the jobs that write files into the poc_netops repository.
+#
+# What it does:
+# 1. commit_paths(): stage a set of files and commit them in one go
+#    (usually a single "git commit --only -- <paths>", instead of one
+#    "git add" + "git commit" pair per file)
+# 2. defer_commit() / flush_pending(): let a job only *register* a written file,
+#    so the caller (e.g. ConfigPipeline) can commit everything at the end at once.
+#    Files are registered in a batch (new_batch()) that belongs to one run, so a
+#    run never commits - or leaves behind - another run's files
+# 3. submit(): run git work on one background thread, so the caller can keep
+#    talking to the device while git commits
+# 4. push(): "git push" to the remote, logging (never raising) failures
+#    enqueue_push(): the same on a background thread, so jobs don't wait for it
+# 5. repo_info(): where the repository is and whether it is a git repo,
+#    resolved once per worker process instead of on every job run
+#    repo_dir(): a top-level folder of the repository, created only if missing
+# 6. head_matches(): compare bytes with a file's content in HEAD through one
+#    long-lived "git cat-file --batch-command" process per repository
+# 7. Opt-in (POC_NETOPS_GITPYTHON=1, GitPython installed): commits happen
+#    in-process through one cached git.Repo handle per repository (no git process
+#    at all); by default, or if that fails, through the git command line as above
+#
+# Why we need this:
+# Every git process pays fork/exec, reads the index and takes .git/index.lock.
+# When the pipeline touches several files (or several devices), doing that once
+# instead of once per file is noticeably faster.
+
+import atexit
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# GitPython is optional and opt-in. With POC_NETOPS_GITPYTHON=1 (and GitPython
+# installed), commit_paths() stages and commits in-process instead of starting
+# git processes. Off by default: unlike "git commit --only" it commits whatever
+# else is staged in the repository too (see _commit_in_process).
+try:
+    import git as gitpython
+except ImportError:
+    gitpython = None
+
+_USE_GITPYTHON = gitpython is not None and os.environ.get("POC_NETOPS_GITPYTHON", "0") == "1"
+
+# Where the poc_netops repository lives (the environment variable wins)
+REPO_ENV_VAR = "POC_NETOPS_REPO"
+DEFAULT_REPO_PATH = "/opt/nautobot/git/poc_netops"
+
+# One background thread for git work. A single worker means git operations
+# queue up in order instead of fighting over .git/index.lock.
+_GIT_WORKER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="poc-netops-git")
+
+# Held while staging + committing, so a commit from the worker thread and a
+# synchronous commit from another job never interleave their add/commit calls
+_INDEX_LOCK = threading.Lock()
+
+
+def submit(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the git worker thread and return its Future."""
+    return _GIT_WORKER.submit(fn, *args, **kwargs)
+
+
+# root: Path of the repository, root_str: the same as str (for "git -C ..."),
+# exists: the directory exists, is_git: it contains a .git directory,
+# entries: names of everything directly inside it (e.g. "templates", "intended")
+RepoInfo = namedtuple("RepoInfo", ["root", "root_str", "exists", "is_git", "entries"])
+
+# (env_var, default) -> RepoInfo, only filled once the repository is complete
+_REPO_INFO = {}
+
+
+def repo_info(env_var=REPO_ENV_VAR, default=DEFAULT_REPO_PATH):
+    """
+    Resolve the repository location and check it, memoized for the process lifetime.
+
+    Every job run used to read the environment, build a Path and stat the directory
+    and its .git again. The repository doesn't move while the worker is running, so
+    once it is found we remember the result. A missing or not-yet-initialized
+    repository is not remembered - it is checked again on the next run, so creating
+    it doesn't require a worker restart.
+    """
+    key = (env_var, default)
+    info = _REPO_INFO.get(key)
+    if info is not None:
+        return info
+
+    root = Path(os.environ.get(env_var, default))
+    # One directory listing answers "does it exist", "is there a .git" and
+    # "which folders are there" - instead of a separate stat() for each question
+    try:
+        with os.scandir(root) as it:
+            entries = frozenset(entry.name for entry in it)
+        exists = True
+    except (FileNotFoundError, NotADirectoryError):
+        entries, exists = frozenset(), False
+    info = RepoInfo(root, str(root), exists, ".git" in entries, entries)
+    if info.is_git:
+        _REPO_INFO[key] = info
+    return info
+
+
+def repo_dir(repo, name):
+    """
+    Return repo.root / name, creating the folder if it wasn't there when repo_info() looked.
+
+    mkdir(exist_ok=True) costs a mkdir() plus a stat() on every run even though the
+    folder is almost always there already; the directory listing tells us that for free.
+    """
+    path = repo.root / name
+    if name not in repo.entries:
+        path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def run_git(repo_root, *args, input=None, want_stdout=True):
+    """
+    Run a git command inside repo_root and return the CompletedProcess (never raises on exit code).
+
+    stdout/stderr are raw bytes: on the happy path we mostly ignore git's output, so
+    we don't pay for decoding it. Use _decode() where the text is actually needed.
+    With want_stdout=False stdout goes to /dev/null (one pipe less to read) and
+    .stdout is None - stderr is always captured for error messages.
+    """
+    return subprocess.run(
+        ["git", "-C", str(repo_root), *args],
+        input=input,
+        stdout=subprocess.PIPE if want_stdout else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,  # Capture errors for logging
+        check=False,  # Don't raise exception on non-zero exit
+    )
+
+
+def _decode(output):
+    """Turn git output (bytes) into a stripped string for logging/inspection."""
+    return output.decode("utf-8", errors="replace").strip()
+
+
+def stage_paths(repo_root, rel_paths, logger, log_prefix):
+    """
+    Write the files as blobs and put them into the index - the plumbing version of "git add".
+
+    One "git hash-object -w --stdin-paths" hashes all files in a single process, and one
+    "git update-index --index-info" records them all. Unlike "git add", git doesn't have
+    to scan the worktree to find out what changed: we already know which files we wrote.
+
+    Returns:
+        True if all files were staged, False otherwise
+    """
+    encoded_paths = [os.fsencode(path) for path in rel_paths]
+    hash_proc = run_git(
+        repo_root, "hash-object", "-w", "--stdin-paths",
+        input=b"\n".join(encoded_paths) + b"\n",
+    )
+    shas = hash_proc.stdout.split()
+    if hash_proc.returncode != 0 or len(shas) != len(rel_paths):
+        logger.error(
+            "%s git hash-object failed with exit code %s. "
+            "Errors: '%s'",
+            log_prefix,
+            hash_proc.returncode,
+            _decode(hash_proc.stderr),
+        )
+        return False
+
+    # Config files are plain, non-executable files -> mode 100644
+    index_info = b"".join(
+        b"100644 " + sha + b"\t" + path + b"\n" for sha, path in zip(shas, encoded_paths)
+    )
+    update_proc = run_git(
+        repo_root, "update-index", "--add", "--index-info", input=index_info, want_stdout=False
+    )
+    if update_proc.returncode != 0:
+        logger.error(
+            "%s git update-index failed with exit code %s. "
+            "Errors: '%s'",
+            log_prefix,
+            update_proc.returncode,
+            _decode(update_proc.stderr),
+        )
+        return False
+
+    logger.info("%s Staged %s file(s) via git hash-object/update-index.", log_prefix, len(rel_paths))
+    return True
+
+
+def commit_paths(repo_root, rel_paths, message, logger, log_prefix, allow_empty=False):
+    """
+    Commit exactly the given paths, normally with a single "git commit --only" process.
+
+    Files git doesn't track yet are staged in one batch first (see stage_paths).
+
+    Args:
+        repo_root: Path of the Git repository
+        rel_paths: Paths relative to repo_root
+        message: Commit message
+        logger: Logger to report to
+        log_prefix: Prefix for log lines, e.g. "[BackupDeviceConfig]"
+        allow_empty: Create a commit even if nothing changed (audit trail of runs)
+
+    Returns:
+        True if a commit was created, False otherwise
+    """
+    rel_paths = [str(p) for p in rel_paths]
+    if not rel_paths and not allow_empty:
+        return False
+
+    try:
+        with _INDEX_LOCK:
+            return _add_and_commit(repo_root, rel_paths, message, logger, log_prefix, allow_empty)
+    except Exception as e:
+        logger.error("%s Error during git operations in %s: %s", log_prefix, repo_root, e)
+        return False
+
+
+def _add_and_commit(repo_root, rel_paths, message, logger, log_prefix, allow_empty):
+    """The actual git add + git commit (caller holds _INDEX_LOCK)."""
+    if _USE_GITPYTHON:
+        try:
+            return _commit_in_process(repo_root, rel_paths, message, logger, log_prefix, allow_empty)
+        except Exception as e:
+            # Whatever GitPython didn't like, the git command line gets another go
+            logger.warning("%s In-process git commit failed (%s), falling back to git CLI.", log_prefix, e)
+
+    if rel_paths:
+        logger.info("%s Committing %s file(s): %s", log_prefix, len(rel_paths), ", ".join(rel_paths))
+        # Fast path: "git commit --only -- <paths>" stages the given files itself,
+        # so the whole add + commit is one git process. Git only accepts paths it
+        # already tracks here - the very first write of a file takes the slow path.
+        commit_proc = _commit(repo_root, message, allow_empty, ["--only", "--", *rel_paths])
+        if commit_proc.returncode == 0 or b"did not match any file(s) known to git" not in commit_proc.stderr:
+            return _log_commit(commit_proc, logger, log_prefix)
+
+        logger.info("%s New file(s) in the repository, staging them first.", log_prefix)
+        if not stage_paths(repo_root, rel_paths, logger, log_prefix):
+            return False
+
+    return _log_commit(_commit(repo_root, message, allow_empty), logger, log_prefix)
+
+
+# repo_root (str) -> git.Repo, kept for the lifetime of the worker process.
+# GitPython objects are not thread-safe: only use them while holding _REPOS_LOCK.
+_REPOS = {}
+_REPOS_LOCK = threading.Lock()
+
+
+def _commit_in_process(repo_root, rel_paths, message, logger, log_prefix, allow_empty):
+    """
+    git add + git commit through GitPython, without starting a git process.
+
+    The git.Repo handle is cached, so refs and config are only read once. repo.index
+    re-reads .git/index on every access, so changes made by git itself are seen.
+    Note: unlike "git commit --only", anything else already staged is committed too.
+    That is why this path is opt-in - only switch it on for a repository nobody
+    stages files in by hand.
+    """
+    with _REPOS_LOCK:
+        return _commit_with_repo(_cached_repo(repo_root), rel_paths, message, logger, log_prefix, allow_empty)
+
+
+def _cached_repo(repo_root):
+    """The cached git.Repo for repo_root (caller holds _REPOS_LOCK)."""
+    key = str(repo_root)
+    repo = _REPOS.get(key)
+    if repo is None:
+        repo = _REPOS[key] = gitpython.Repo(key)
+    return repo
+
+
+def _commit_with_repo(repo, rel_paths, message, logger, log_prefix, allow_empty):
+    """The actual in-process add + commit (caller holds _REPOS_LOCK)."""
+    index = repo.index
+    if rel_paths:
+        logger.info("%s Committing %s file(s): %s", log_prefix, len(rel_paths), ", ".join(rel_paths))
+        index.add(rel_paths)
+
+    # Same tree as HEAD = our files are identical to what is committed
+    parent = repo.head.commit if repo.head.is_valid() else None
+    if not allow_empty and parent is not None and index.write_tree().binsha == parent.tree.binsha:
+        logger.info("%s Nothing changed since the last commit, no commit created.", log_prefix)
+        return False
+
+    commit = index.commit(message)
+    logger.info("%s git commit completed in-process: %s", log_prefix, commit.hexsha[:12])
+    return True
+
+
+def _commit(repo_root, message, allow_empty, extra_args=()):
+    """Run "git commit -q -m <message>" with optional --allow-empty and extra arguments."""
+    # -q: no summary on success (we'd only throw it away). "nothing to commit"
+    # is still printed, _log_commit looks for it.
+    commit_args = ["commit", "-q", "-m", message, *extra_args]
+    if allow_empty:
+        commit_args.insert(1, "--allow-empty")
+    return run_git(repo_root, *commit_args)
+
+
+# Messages of "git commit" when there is nothing new to commit for the given paths
+_NOTHING_TO_COMMIT = ("nothing to commit", "no changes added to commit")
+
+
+def _log_commit(commit_proc, logger, log_prefix):
+    """Log the result of a git commit and return True if a commit was created."""
+    if commit_proc.returncode == 0:
+        # Happy path - nothing to decode (git commit -q prints no summary)
+        logger.info("%s git commit completed: rc=0", log_prefix)
+        return True
+
+    stdout = _decode(commit_proc.stdout)
+    stderr = _decode(commit_proc.stderr)
+    # Exit code 1 with one of these messages means: our files are identical to HEAD.
+    # "nothing to commit" if the worktree is clean, "no changes added to commit" if
+    # other files are modified (git commit --only ignores those, but still says so).
+    if any(msg in output for msg in _NOTHING_TO_COMMIT for output in (stdout, stderr)):
+        # Not an error, just nothing new to record
+        logger.info("%s Nothing changed since the last commit, no commit created.", log_prefix)
+        return False
+
+    logger.error(
+        "%s git commit failed with exit code %s. "
+        "Output: '%s' | Errors: '%s'",
+        log_prefix,
+        commit_proc.returncode,
+        stdout,
+        stderr,
+    )
+    return False
+
+
+# --- Deferred commits ---
+# (repo_root (str), batch) -> list of (rel_path, message) written but not yet committed
+_PENDING = {}
+_PENDING_LOCK = threading.Lock()
+
+
+def new_batch():
+    """A fresh batch id for defer_commit/flush_pending - one per pipeline or bulk run."""
+    return uuid.uuid4().hex
+
+
+def defer_commit(repo_root, rel_path, message, batch):
+    """Remember a written file so it gets committed by flush_pending() of its batch."""
+    with _PENDING_LOCK:
+        _PENDING.setdefault((str(repo_root), batch), []).append((str(rel_path), message))
+
+
+def flush_pending(repo_root, logger, log_prefix, batch, message=None):
+    """
+    Commit every deferred file of one batch in a single git add + git commit.
+
+    Args:
+        batch: The batch the files were registered in (see new_batch)
+        message: Commit message. Defaults to the collected per-file messages.
+
+    Returns:
+        True if a commit was created, False otherwise
+    """
+    with _PENDING_LOCK:
+        pending = _PENDING.pop((str(repo_root), batch), [])
+    if not pending:
+        return False
+
+    # Keep order, drop duplicates (same file registered twice)
+    rel_paths = list(dict.fromkeys(path for path, _ in pending))
+    if message is None:
+        messages = list(dict.fromkeys(msg for _, msg in pending))
+        message = messages[0] if len(messages) == 1 else "; ".join(messages)
+
+    return commit_paths(repo_root, rel_paths, message, logger, log_prefix)
+
+
+def push(repo_root, logger, log_prefix):
+    """
+    Run "git push" for repo_root. Failures are logged, never raised - commits stay local.
+
+    Returns:
+        (ok, error) - ok is True if the push succeeded, error is the error text otherwise
+    """
+    # Try to push to remote
+    logger.info("%s ==========================================", log_prefix)
+    logger.info("%s Running 'git push' to sync commits to remote repository", log_prefix)
+    logger.info("%s Repository: %s", log_prefix, repo_root)
+    logger.info("%s ==========================================", log_prefix)
+
+    try:
+        # Run git push command
+        push_proc = run_git(repo_root, "push", want_stdout=False)
+
+        # Log the results
+        logger.info("%s git push exit code: %s", log_prefix, push_proc.returncode)
+
+        if push_proc.returncode == 0:
+            # Success
+            logger.info("%s git push succeeded.", log_prefix)
+            return True, None
+
+        # Failed - might be no remote configured, authentication issue, etc.
+        error = _decode(push_proc.stderr)
+        logger.warning(
+            "%s git push failed. This is not critical - commits are "
+            "still saved locally. Error: '%s'",
+            log_prefix,
+            error,
+        )
+        return False, error
+
+    except Exception as e:
+        # Command execution failed
+        logger.error(
+            "%s Exception while running git push: %s. "
+            "Commits are still saved locally in %s.",
+            log_prefix,
+            e,
+            repo_root,
+        )
+        return False, str(e)
+
+
+class _GitPushWorker:
+    """
+    Runs "git push" on a background daemon thread, so jobs don't wait for the remote.
+
+    Jobs call enqueue(repo_root) and return right away. A repository that is already
+    waiting in the queue is not queued again - one push sends all commits made so
+    far anyway. Failed pushes are appended to .git/poc-netops-push-failures.log
+    (inside .git, so it is never committed) for a later retry. If the worker stops
+    before a queued push ran, nothing is lost either: the commits are local and the
+    next push sends them.
+    """
+
+    FAILURE_LOG_NAME = "poc-netops-push-failures.log"
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        # Repositories currently waiting in the queue (for de-duplication)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        # The job's logger is gone once the job returned - the worker logs here instead
+        self._logger = logging.getLogger(__name__)
+
+    def enqueue(self, repo_root):
+        """
+        Queue a "git push" for repo_root.
+
+        Returns:
+            True if a push was queued, False if one was already waiting
+        """
+        key = str(repo_root)
+        with self._lock:
+            if key in self._queued:
+                return False
+            self._queued.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._drain_forever, name="poc-netops-git-push", daemon=True
+                )
+                self._thread.start()
+        self._queue.put(key)
+        return True
+
+    def _drain_forever(self):
+        while True:
+            key = self._queue.get()
+            # Un-mark before pushing: commits made while we push need another push
+            with self._lock:
+                self._queued.discard(key)
+            ok, error = push(key, self._logger, "[GitPushWorker]")
+            if not ok:
+                self._record_failure(key, error)
+
+    def _record_failure(self, repo_root, error):
+        # One line per failure: timestamp, then git's (multi-line) error flattened
+        error = " ".join(str(error).split())
+        line = f"{time.strftime('%Y-%m-%dT%H:%M:%S')} git push failed: {error}\n"
+        try:
+            with open(Path(repo_root) / ".git" / self.FAILURE_LOG_NAME, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            self._logger.error("[GitPushWorker] Could not record failed push for %s: %s", repo_root, e)
+
+
+# The one push worker shared by every job in this worker process
+_PUSH_WORKER = _GitPushWorker()
+
+
+def enqueue_push(repo_root):
+    """Queue a background "git push" for repo_root (see _GitPushWorker)."""
+    return _PUSH_WORKER.enqueue(repo_root)
+
+
+class _GitSession:
+    """
+    One long-lived "git cat-file --batch-command" process for reading from a repository.
+
+    Starting git costs tens of milliseconds. For small read-only questions ("what does
+    this file look like in HEAD?") we keep one process running and talk to it through
+    stdin/stdout instead. "HEAD:<path>" is resolved again for every command, so new
+    commits are seen right away. Needs git 2.36 or newer - with older versions the
+    process exits immediately and every query answers "unknown" (None).
+    """
+
+    def __init__(self, repo_root):
+        self.repo_root = str(repo_root)
+        self._proc = None
+        self._dead = False
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._proc is None:
+            self._proc = subprocess.Popen(
+                ["git", "-C", self.repo_root, "cat-file", "--batch-command"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        return self._proc
+
+    def head_blob(self, rel_path):
+        """
+        Return the content of rel_path in HEAD.
+
+        Returns:
+            (known, content) - known is False if git couldn't be asked (content is None
+            then); otherwise content is the file's bytes, or None if it isn't in HEAD
+        """
+        with self._lock:
+            if self._dead:
+                return False, None
+            try:
+                proc = self._ensure_started()
+                proc.stdin.write(f"contents HEAD:{rel_path}\n".encode("utf-8"))
+                proc.stdin.flush()
+
+                # Header: "<sha> blob <size>" or "<name> missing"
+                header = proc.stdout.readline().split()
+                if not header:
+                    raise OSError("git cat-file exited")
+                if header[-1] == b"missing":
+                    return True, None
+
+                size = int(header[2])
+                content = proc.stdout.read(size + 1)[:size]  # + the LF after the content
+                return True, content
+            except (OSError, ValueError, IndexError):
+                # Old git, repository gone, ... - stop asking, callers fall back
+                self._dead = True
+                self._close_locked()
+                return False, None
+
+    def close(self):
+        with self._lock:
+            self._close_locked()
+
+    def _close_locked(self):
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+            except Exception:
+                self._proc.kill()
+            self._proc = None
+
+
+# repo_root (str) -> _GitSession
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _close_sessions():
+    for session in list(_SESSIONS.values()):
+        session.close()
+
+
+atexit.register(_close_sessions)
+
+
+def head_matches(repo_root, rel_path, data):
+    """
+    Check whether rel_path in HEAD has exactly the content data (bytes).
+
+    Returns:
+        True/False, or None if that couldn't be determined
+    """
+    key = str(repo_root)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = _SESSIONS[key] = _GitSession(key)
+
+    known, content = session.head_blob(str(rel_path))
+    if not known:
+        return None
+    return content == data
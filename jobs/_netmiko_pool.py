@@ -0,0 +1,246 @@
+# _netmiko_pool.py
+#
+# A small process-wide pool of Netmiko SSH connections, shared by all jobs.
+#
+# What it does:
+# 1. Hands out an idle, still-alive connection for (host, port, username, driver) if one exists
+# 2. Otherwise opens a new one with ConnectHandler
+# 3. Takes connections back after use so the next job can reuse them
+# 4. Closes connections that sat idle too long or are simply too old (background reaper)
+# 5. Limits how many logins to the same host may be in progress at once (ssh_startup_slot)
+#
+# Why we need this:
+# Opening an SSH session to a Junos device (TCP + SSH handshake + auth + CLI startup)
+# takes seconds. When several jobs hit the same device in quick succession (bulk VLAN
+# changes, repeated pipeline runs), reusing an already-authenticated session is
+# almost free compared to logging in again every time.
+#
+# Tuning (environment variables):
+#   CONNECTION_POOL_MAX_SIZE      - max idle connections kept in total (default 100)
+#   CONNECTION_POOL_IDLE_TIMEOUT  - close connections idle longer than this, seconds (default 300)
+#   CONNECTION_POOL_MAX_AGE       - never reuse connections older than this, seconds (default 3600)
+#   POC_NETOPS_MAX_SSH_STARTUPS   - max logins in progress per host and worker process (default 8)
+
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Import Netmiko once, when the module is loaded, instead of on every job run.
+# Its import chain (paramiko, cryptography, textfsm, ...) is heavy. If it isn't
+# installed, ConnectHandler stays None and the jobs report that themselves.
+try:
+    from netmiko import ConnectHandler, file_transfer
+except ImportError:
+    ConnectHandler = None
+    file_transfer = None
+
+
+def _env_int(var_name, default):
+    """Read an integer setting from the environment, falling back to the default."""
+    try:
+        return int(os.environ.get(var_name, default))
+    except ValueError:
+        return default
+
+
+# sshd's MaxStartups (default "10:30:100") starts dropping new connections that are
+# still unauthenticated once 10 are pending. Bulk jobs open many sessions at once,
+# so we stay below that per host - only the login is limited, not the open sessions.
+MAX_SSH_STARTUPS = max(1, _env_int("POC_NETOPS_MAX_SSH_STARTUPS", 8))
+
+# host -> BoundedSemaphore(MAX_SSH_STARTUPS)
+_STARTUP_SLOTS = {}
+_STARTUP_LOCK = threading.Lock()
+
+
+@contextmanager
+def ssh_startup_slot(host):
+    """Hold one of the host's MAX_SSH_STARTUPS login slots while connecting."""
+    slot = _STARTUP_SLOTS.get(host)
+    if slot is None:
+        with _STARTUP_LOCK:
+            slot = _STARTUP_SLOTS.setdefault(host, threading.BoundedSemaphore(MAX_SSH_STARTUPS))
+    with slot:
+        yield
+
+
+class _PooledConnection:
+    """Bookkeeping for one idle connection sitting in the pool."""
+
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn, created_at):
+        self.conn = conn
+        self.created_at = created_at
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of Netmiko connections keyed by (host, port, username, driver).
+
+    Usage:
+        with POOL.acquire(device_params) as conn:
+            output = conn.send_command("show version")
+
+    If the block raises, the connection is treated as broken and closed instead of
+    being returned to the pool.
+    """
+
+    def __init__(self, max_size=100, idle_timeout=300, max_age=3600):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+
+        # key -> deque of _PooledConnection (idle connections only)
+        self._idle = {}
+        # id(conn) -> (key, created_at) for connections currently checked out
+        self._in_use = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    @staticmethod
+    def _key(device_params):
+        """Build the pool key from ConnectHandler keyword arguments."""
+        return (
+            device_params["host"],
+            device_params.get("port", 22),
+            device_params["username"],
+            device_params["device_type"],
+        )
+
+    @contextmanager
+    def acquire(self, device_params):
+        """Context manager: check out a connection and give it back afterwards."""
+        conn = self.checkout(device_params)
+        try:
+            yield conn
+        except Exception:
+            # Something went wrong mid-session - don't hand this one to the next job
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def checkout(self, device_params):
+        """
+        Get a live connection for the given parameters.
+
+        Reuses an idle pooled connection if possible, otherwise opens a new one.
+        Raises whatever ConnectHandler raises if the device can't be reached.
+        """
+        key = self._key(device_params)
+        self._start_reaper()
+
+        while True:
+            with self._lock:
+                bucket = self._idle.get(key)
+                entry = bucket.pop() if bucket else None
+            if entry is None:
+                break
+
+            # Too old, or the device dropped the session - close it and try the next one
+            if time.monotonic() - entry.created_at > self.max_age or not self._is_alive(entry.conn):
+                self._close(entry.conn)
+                continue
+
+            with self._lock:
+                self._in_use[id(entry.conn)] = (key, entry.created_at)
+            return entry.conn
+
+        # Nothing reusable - open a fresh connection (outside the lock, this takes seconds)
+        if ConnectHandler is None:
+            raise ModuleNotFoundError("The 'netmiko' library is not installed")
+        with ssh_startup_slot(device_params["host"]):
+            conn = ConnectHandler(**device_params)
+        with self._lock:
+            self._in_use[id(conn)] = (key, time.monotonic())
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool (or close it if discard=True or the pool is full)."""
+        with self._lock:
+            key, created_at = self._in_use.pop(id(conn), (None, None))
+            idle_count = sum(len(bucket) for bucket in self._idle.values())
+            keep = not discard and key is not None and idle_count < self.max_size
+            if keep:
+                self._idle.setdefault(key, deque()).append(_PooledConnection(conn, created_at))
+
+        if not keep:
+            self._close(conn)
+
+    def close_idle(self):
+        """Close all idle connections that exceeded the idle timeout or max age."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, bucket in list(self._idle.items()):
+                keep = deque()
+                for entry in bucket:
+                    if now - entry.last_used > self.idle_timeout or now - entry.created_at > self.max_age:
+                        expired.append(entry.conn)
+                    else:
+                        keep.append(entry)
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+
+        for conn in expired:
+            self._close(conn)
+
+    def close_all(self):
+        """Close every idle connection (used at interpreter shutdown)."""
+        with self._lock:
+            entries = [entry for bucket in self._idle.values() for entry in bucket]
+            self._idle.clear()
+        for entry in entries:
+            self._close(entry.conn)
+
+    def _start_reaper(self):
+        """Start the background thread that closes idle connections (once per process)."""
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(
+                target=self._reap_forever, name="netmiko-pool-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def _reap_forever(self):
+        # Check a few times per idle timeout so connections don't linger much longer than allowed
+        interval = max(1, min(60, self.idle_timeout // 2))
+        while True:
+            time.sleep(interval)
+            self.close_idle()
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            return conn.is_alive()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.disconnect()
+        except Exception:
+            # Already gone - nothing else we can do
+            pass
+
+
+# The one pool shared by every job running in this worker process
+POOL = ConnectionPool(
+    max_size=_env_int("CONNECTION_POOL_MAX_SIZE", 100),
+    idle_timeout=_env_int("CONNECTION_POOL_IDLE_TIMEOUT", 300),
+    max_age=_env_int("CONNECTION_POOL_MAX_AGE", 3600),
+)
+
+# Log out of devices cleanly when the worker shuts down
+atexit.register(POOL.close_all)
@@ -0,0 +1,109 @@
+# _scrapli_async.py
+#
+# Optional asyncio transport for the bulk push, using scrapli with asyncssh.
+#
+# What it does:
+# 1. Opens one async SSH session per device (scrapli's AsyncJunosDriver)
+# 2. Sends each device's batch of commands with send_configs and commits it
+#    (private candidate, like the Netmiko push)
+# 3. Runs all devices concurrently in ONE thread on one event loop
+#    (at most max_concurrency sessions open at the same time, and at most
+#    MAX_SSH_STARTUPS logins in progress per host - see _netmiko_pool.py)
+#
+# Why we need this:
+# The Netmiko bulk push needs one thread per device that is being pushed, and
+# each thread just sits there waiting on SSH. An event loop waits on all sessions
+# at once, so many devices are pushed without a thread (and its memory) for each.
+#
+# Tuning (environment variable):
+#   PUSH_TRANSPORT - "scrapli" to use this for the bulk push (default "netmiko").
+#                    Falls back to the threaded Netmiko push when scrapli or
+#                    asyncssh isn't installed (pip install "scrapli[asyncssh]").
+
+import asyncio
+import os
+
+from ._netmiko_pool import MAX_SSH_STARTUPS
+
+# scrapli is optional: imported once when the module is loaded, None if missing
+try:
+    import asyncssh  # noqa: F401 - only checked: scrapli's "asyncssh" transport needs it
+    from scrapli.driver.core import AsyncJunosDriver
+except ImportError:
+    AsyncJunosDriver = None
+
+_TRANSPORT = os.environ.get("PUSH_TRANSPORT", "netmiko").strip().lower()
+
+
+def scrapli_enabled():
+    """True if the bulk push should use scrapli/asyncio (requested and installed)."""
+    return _TRANSPORT == "scrapli" and AsyncJunosDriver is not None
+
+
+async def _send_one(semaphore, startup_slot, device_params, config_lines, timeout):
+    """
+    Send one device's commands over its own async SSH session, return the output.
+
+    Raises RuntimeError if the device rejected a command or the commit.
+    """
+    async with semaphore:
+        conn = AsyncJunosDriver(
+            host=device_params["host"],
+            auth_username=device_params["username"],
+            auth_password=device_params["password"],
+            auth_strict_key=False,  # Same as Netmiko: no known_hosts check
+            transport="asyncssh",
+            timeout_socket=device_params.get("timeout", 30),
+            timeout_ops=timeout,
+        )
+        # Only the login is limited per host (sshd's MaxStartups), not the session
+        # (opened and closed by hand: "async with conn" would open it a second time)
+        async with startup_slot:
+            await conn.open()
+        try:
+            # Private candidate + commit, the same transaction as the Netmiko push
+            response = await conn.send_configs(
+                [*config_lines, "commit"],
+                privilege_level="configuration_private",
+            )
+            # scrapli doesn't raise for commands the device rejected (or a failed
+            # commit), it only flags them - raise, so the caller counts the device as failed
+            if response.failed:
+                rejected = [r.channel_input for r in response if r.failed]
+                raise RuntimeError(f"Device rejected {', '.join(rejected)}: {response.result}")
+            return response.result
+        finally:
+            await conn.close()
+
+
+def send_many(batches, max_concurrency, timeout=30):
+    """
+    Push several devices concurrently on one event loop.
+
+    Args:
+        batches: List of (key, device_params, config_lines) - key is anything the
+                 caller uses to match the results (e.g. the Device)
+        max_concurrency: Max SSH sessions open at the same time
+        timeout: Seconds to wait for the device per operation
+
+    Returns:
+        Dict key -> output (str), or the exception raised for that device
+    """
+
+    async def _main():
+        semaphore = asyncio.Semaphore(max_concurrency)
+        # host -> asyncio.Semaphore; created here because they belong to this loop
+        startup_slots = {}
+        for _, params, _ in batches:
+            startup_slots.setdefault(params["host"], asyncio.Semaphore(MAX_SSH_STARTUPS))
+        results = await asyncio.gather(
+            *(
+                _send_one(semaphore, startup_slots[params["host"]], params, lines, timeout)
+                for _, params, lines in batches
+            ),
+            return_exceptions=True,  # One failing device doesn't cancel the others
+        )
+        return {key: result for (key, _, _), result in zip(batches, results)}
+
+    # Called from a (synchronous) job thread: no loop running yet, so run our own
+    return asyncio.run(_main())
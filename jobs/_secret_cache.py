@@ -0,0 +1,129 @@
+# _secret_cache.py
+#
+# In-memory cache for SecretsGroup credential lookups, shared by all jobs.
+#
+# What it does:
+# 1. Wraps secrets_group.get_secret_value(...) with a per-process cache
+# 2. Keys entries by (secrets group, device, secret type, access type)
+# 3. Expires entries after a TTL so rotated credentials are picked up eventually
+# 4. Single-flight: threads missing the same key at once share ONE backend lookup
+# 5. Drops the cached entries of a group when the group, one of its secret
+#    assignments or a secret is saved/deleted (Django signals)
+#
+# Why we need this:
+# Every lookup goes to the secrets backend (Vault, Delinea, ...). The pipeline asks
+# for the same username/password several times per device, and bulk runs ask for
+# them for every device again. Caching for a few minutes removes those round trips.
+#
+# Tuning (environment variable):
+#   SECRET_CACHE_TTL - seconds a cached credential stays valid (default 300, 0 disables)
+
+import os
+import threading
+import time
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from nautobot.extras.models import Secret, SecretsGroup, SecretsGroupAssociation
+from nautobot.extras.secrets.exceptions import SecretError
+
+try:
+    _TTL = float(os.environ.get("SECRET_CACHE_TTL", 300))
+except ValueError:
+    _TTL = 300.0
+
+# (secrets_group.pk, device.pk, secret_type, access_type) -> (expires_at, value)
+_CACHE = {}
+_LOCK = threading.Lock()
+# key -> Event of the lookup currently running for it (set when it is done)
+_INFLIGHT = {}
+
+
+def get_cached_secret(secrets_group, secret_type, access_type, device):
+    """
+    Return a secret value for a device, using the cache when possible.
+
+    Same result as secrets_group.get_secret_value(secret_type=..., access_type=..., obj=device).
+    SecretError is passed through to the caller (and nothing is cached for it).
+    """
+    if _TTL <= 0:
+        # Caching disabled - nothing to share between threads either
+        return secrets_group.get_secret_value(
+            secret_type=secret_type,
+            access_type=access_type,
+            obj=device,
+        )
+
+    key = (secrets_group.pk, device.pk, secret_type, access_type)
+
+    while True:
+        now = time.monotonic()
+        with _LOCK:
+            entry = _CACHE.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            # Is another thread asking the backend for this right now? Then wait for it
+            # instead of sending the same request a second time
+            event = _INFLIGHT.get(key)
+            if event is None:
+                event = _INFLIGHT[key] = threading.Event()
+                break
+        event.wait()
+        # Back to the top: normally the value is in the cache now. If that lookup
+        # failed, one of the waiting threads tries again itself.
+
+    # We are the thread that asks the backend
+    try:
+        value = secrets_group.get_secret_value(
+            secret_type=secret_type,
+            access_type=access_type,
+            obj=device,
+        )
+    except SecretError:
+        # Backend refused or the secret is misconfigured - forget anything we had
+        invalidate(secrets_group.pk)
+        raise
+    else:
+        with _LOCK:
+            _CACHE[key] = (now + _TTL, value)
+        return value
+    finally:
+        # Wake up the waiting threads (they find the value in the cache)
+        with _LOCK:
+            _INFLIGHT.pop(key, None)
+        event.set()
+
+
+def invalidate(secrets_group_pk=None):
+    """Drop cached secrets for one SecretsGroup, or everything if no pk is given."""
+    with _LOCK:
+        if secrets_group_pk is None:
+            _CACHE.clear()
+            return
+        for key in [k for k in _CACHE if k[0] == secrets_group_pk]:
+            del _CACHE[key]
+
+
+# --- Invalidation on changes ---
+# Signals only fire in the process that saves the object: edits made by a job in
+# this worker take effect at once, edits in the web UI (another process) within the TTL.
+
+
+@receiver([post_save, post_delete], sender=SecretsGroup, dispatch_uid="poc_netops_secret_cache_group")
+def _secrets_group_changed(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+
+@receiver(
+    [post_save, post_delete],
+    sender=SecretsGroupAssociation,
+    dispatch_uid="poc_netops_secret_cache_association",
+)
+def _secrets_group_association_changed(sender, instance, **kwargs):
+    invalidate(instance.secrets_group_id)
+
+
+@receiver([post_save, post_delete], sender=Secret, dispatch_uid="poc_netops_secret_cache_secret")
+def _secret_changed(sender, instance, **kwargs):
+    # A secret can be part of several groups - simply start over
+    invalidate()
@@ -0,0 +1,70 @@
+# _task_log.py
+#
+# Keeps log lines written from helper threads in the job's result.
+#
+# What it does:
+# 1. task_logger() is called on the job's own thread and remembers the Celery
+#    task id of the running job
+# 2. The returned logger adds that task id to every line it logs, from whatever
+#    thread it is used in
+#
+# Why we need this:
+# Nautobot stores a job's log lines in its JobResult by the task id of each log
+# record. Celery fills that id in from the *current* task, which only exists on
+# the job's own thread - a line logged from a pool thread (step 2 of the pipeline,
+# the bulk jobs' workers, the git thread) gets task id "???" and is silently
+# dropped, errors included. Celery only fills the id in when the record doesn't
+# have one yet, so passing it along with extra={"task_id": ...} is enough.
+
+from celery import current_task
+
+
+class TaskLogger:
+    """
+    Wraps a job logger and adds the job's task id to every record (see above).
+
+    Everything else (isEnabledFor, level, ...) goes to the wrapped logger.
+    """
+
+    def __init__(self, logger, task_id):
+        self._logger = logger
+        self._task_id = task_id
+
+    def __getattr__(self, name):
+        return getattr(self._logger, name)
+
+    def _log(self, method, msg, args, kwargs):
+        # Our task id, unless the caller passed one itself
+        kwargs["extra"] = {"task_id": self._task_id, **(kwargs.get("extra") or {})}
+        getattr(self._logger, method)(msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self._log("debug", msg, args, kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._log("info", msg, args, kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self._log("warning", msg, args, kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self._log("error", msg, args, kwargs)
+
+    def success(self, msg, *args, **kwargs):
+        self._log("success", msg, args, kwargs)
+
+
+def task_logger(logger):
+    """
+    Bind logger to the task id of the running job - call this on the job's thread.
+
+    Returns the logger unchanged if it is already bound or no Celery task is
+    running (e.g. the code is called outside a job run).
+    """
+    if isinstance(logger, TaskLogger):
+        return logger
+    request = getattr(current_task, "request", None) if current_task else None
+    task_id = getattr(request, "id", None)
+    if task_id is None:
+        return logger
+    return TaskLogger(logger, task_id)
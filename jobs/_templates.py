@@ -0,0 +1,234 @@
+# _templates.py
+#
+# Shared Jinja2 environment(s) for the jobs that render device templates.
+#
+# What it does:
+# 1. Creates one Jinja2 Environment per template directory, once per worker process
+# 2. Hands out the compiled template (memoized per directory + file name)
+# 3. Keeps Jinja's compiled bytecode on disk, so a freshly started worker doesn't
+#    have to compile the templates again either
+# 4. template_exists(): the "is the template there?" check of the jobs, with the
+#    positive answer trusted for TEMPLATE_EXISTS_TTL seconds. When that check sees
+#    a new mtime, the cached templates are dropped (see invalidate_template_cache)
+# 5. Optionally loads templates that were compiled to Python modules ahead of time
+#    (TEMPLATE_PRECOMPILED_DIR, filled by running this file - see compile_templates)
+# 6. warm_up(): compiles a template in the background right after the worker loaded
+#    the jobs, so the first push doesn't pay for it
+#
+# Why we need this:
+# BuildIntendedConfig and PushConfigToDevice used to build a fresh Environment on
+# every run. A fresh environment has an empty cache, so Jinja read, parsed and
+# compiled templates/juniper_junos.j2 to Python code again for every device.
+# With a shared environment that happens once; later runs reuse the compiled template.
+#
+# Tuning (environment variable):
+#   TEMPLATE_AUTO_RELOAD - "1" to re-check template files for changes on every use
+#                          (default off: an edited template is picked up by the next
+#                          template_exists() check, i.e. within TEMPLATE_EXISTS_TTL seconds)
+#   TEMPLATE_BYTECODE_CACHE_DIR - where to keep the compiled bytecode
+#                          (default: Jinja's folder in the system temp dir, "off" to disable,
+#                          "django" for Nautobot's cache (Redis) - shared by all workers and hosts)
+#   TEMPLATE_PRECOMPILED_DIR - folder with precompiled templates (default: none). Build it with
+#                          python jobs/_templates.py <template dir> <TEMPLATE_PRECOMPILED_DIR>
+#                          It is only used while it is newer than every template file.
+#   TEMPLATE_WARMUP      - "0" to not compile the push template when the jobs are loaded
+
+import os
+import stat
+import sys
+import threading
+import time
+from functools import lru_cache
+
+# Check the template's mtime on every get_template() call? Costs a stat per render.
+_AUTO_RELOAD = os.environ.get("TEMPLATE_AUTO_RELOAD", "0") == "1"
+
+# "" = Jinja's default (<tmp>/_jinja2-cache-<uid>), "off" = no bytecode cache,
+# "django" = Django's default cache
+_BYTECODE_CACHE_DIR = os.environ.get("TEMPLATE_BYTECODE_CACHE_DIR", "")
+
+# Templates compiled to Python modules ahead of time ("" = none)
+_PRECOMPILED_DIR = os.environ.get("TEMPLATE_PRECOMPILED_DIR", "")
+
+# Compile templates in the background when the job modules are loaded?
+_WARMUP = os.environ.get("TEMPLATE_WARMUP", "1") != "0"
+
+# How long a "template file exists" answer is trusted (seconds). Only positive
+# answers are remembered, so a template created after a failed run is found at once.
+TEMPLATE_EXISTS_TTL = 30.0
+# template path (str) -> (time.monotonic() of the last check that found it, st_mtime_ns)
+_EXISTS = {}
+
+# template directory (str) -> Environment
+_ENVS = {}
+_LOCK = threading.Lock()
+
+
+def get_environment(template_dir):
+    """Return the shared Environment for template_dir, creating it on first use."""
+    template_dir = str(template_dir)
+    env = _ENVS.get(template_dir)
+    if env is not None:
+        return env
+
+    with _LOCK:
+        env = _ENVS.get(template_dir)
+        if env is None:
+            # Imported here, not at module top: Nautobot loads all job modules at
+            # worker start, but Jinja2 is only needed once something is rendered
+            from jinja2 import ChoiceLoader, Environment, FileSystemLoader, ModuleLoader
+
+            loader = FileSystemLoader(template_dir)
+            if _precompiled_is_current(template_dir):
+                # Precompiled modules first: no parsing or compiling at all. Templates
+                # missing there (added later) still come from the files.
+                loader = ChoiceLoader([ModuleLoader(_PRECOMPILED_DIR), loader])
+
+            env = Environment(
+                loader=loader,
+                autoescape=False,  # We're generating config, not HTML
+                cache_size=400,  # Keep plenty of compiled templates around
+                auto_reload=_AUTO_RELOAD,
+                bytecode_cache=_bytecode_cache(),  # Survives worker restarts
+            )
+            _ENVS[template_dir] = env
+    return env
+
+
+def _bytecode_cache():
+    """The bytecode cache selected by TEMPLATE_BYTECODE_CACHE_DIR (None = off)."""
+    setting = _BYTECODE_CACHE_DIR
+    if setting.lower() == "off":
+        return None
+
+    # Jinja stores the compiled template keyed by name + source checksum,
+    # so an edited template never picks up stale bytecode
+    if setting.lower() == "django":
+        from django.core.cache import cache
+        from jinja2 import MemcachedBytecodeCache
+
+        # Django's cache has the get(key) / set(key, value, timeout) Jinja expects
+        # from a memcached client - so this works with Nautobot's Redis as well
+        return MemcachedBytecodeCache(cache, prefix="poc_netops:jinja2:", timeout=24 * 3600)
+
+    from jinja2 import FileSystemBytecodeCache
+
+    if setting:
+        os.makedirs(setting, exist_ok=True)
+    return FileSystemBytecodeCache(setting or None)
+
+
+def _precompiled_is_current(template_dir):
+    """
+    True if TEMPLATE_PRECOMPILED_DIR is set and newer than every file in template_dir.
+
+    Precompiled modules don't know their source any more, so after a template was
+    edited (or pulled) they would render the old version - we then skip them until
+    they are built again.
+    """
+    if not _PRECOMPILED_DIR:
+        return False
+    try:
+        built = os.stat(_PRECOMPILED_DIR).st_mtime_ns
+        with os.scandir(template_dir) as entries:
+            newest = max((e.stat().st_mtime_ns for e in entries if e.is_file()), default=0)
+    except OSError:
+        return False
+    return built >= newest
+
+
+def compile_templates(template_dir, target_dir):
+    """
+    Compile every template in template_dir to a Python module in target_dir.
+
+    Run it at deploy time (e.g. in the container build) and point
+    TEMPLATE_PRECOMPILED_DIR at target_dir. The folder's mtime is what
+    _precompiled_is_current() compares, so target_dir is recreated from scratch.
+    """
+    import shutil
+
+    from jinja2 import Environment, FileSystemLoader
+
+    shutil.rmtree(target_dir, ignore_errors=True)
+    env = Environment(loader=FileSystemLoader(str(template_dir)), autoescape=False)
+    # zip=None: plain .py files in a folder (ModuleLoader imports them)
+    env.compile_templates(str(target_dir), zip=None)
+
+
+@lru_cache(maxsize=16)
+def _compiled_template(template_dir, name):
+    """The compiled template object itself, memoized (only used without auto-reload)."""
+    return get_environment(template_dir).get_template(name)
+
+
+def template_exists(template_path):
+    """True if template_path is a file - stat()s it at most every TEMPLATE_EXISTS_TTL seconds."""
+    key = str(template_path)
+    now = time.monotonic()
+    entry = _EXISTS.get(key)
+    if entry is not None and now - entry[0] < TEMPLATE_EXISTS_TTL:
+        return True
+    try:
+        st = os.stat(template_path)
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        _EXISTS.pop(key, None)
+        return False
+    if entry is not None and entry[1] != st.st_mtime_ns:
+        # The template was edited (or the repository pulled) since we compiled it
+        invalidate_template_cache()
+    _EXISTS[key] = (now, st.st_mtime_ns)
+    return True
+
+
+def invalidate_template_cache():
+    """
+    Forget all environments and compiled templates, so the next render compiles again.
+
+    Without auto-reload Jinja never looks at the files again by itself. Called by
+    template_exists() when a template's mtime changed; call it yourself after
+    updating the templates in the repository (e.g. a git pull) to not wait for that.
+    The bytecode cache on disk doesn't need clearing: it is keyed by the source.
+    """
+    with _LOCK:
+        _ENVS.clear()
+    _compiled_template.cache_clear()
+    _EXISTS.clear()
+
+
+def warm_up(template_path):
+    """
+    Load (and so compile) template_path in a background thread.
+
+    Called when a job module is imported. The thread keeps the worker start from
+    waiting for Jinja; if the template can't be loaded yet, nothing happens - the
+    job reports the problem when it actually renders.
+    """
+    if not _WARMUP:
+        return
+
+    def _load():
+        try:
+            if template_exists(template_path):
+                get_template(template_path)
+        except Exception:
+            pass
+
+    threading.Thread(target=_load, name="template-warmup", daemon=True).start()
+
+
+def get_template(template_path):
+    """Load a template (a Path) through the shared environment of its directory."""
+    if _AUTO_RELOAD:
+        # Let Jinja check the file's mtime and recompile after edits
+        return get_environment(template_path.parent).get_template(template_path.name)
+    # Without auto-reload the template never changes - skip even Jinja's cache lookup
+    return _compiled_template(str(template_path.parent), template_path.name)
+
+
+if __name__ == "__main__":
+    # python jobs/_templates.py <template dir> <target dir>
+    if len(sys.argv) != 3:
+        sys.exit("usage: python _templates.py <template dir> <target dir>")
+    compile_templates(sys.argv[1], sys.argv[2])
@@ -7,14 +7,17 @@
 # 2. Runs "show configuration | display set" to get the config in set format
 # 3. Saves the output to a file in the Git repo (backups/<device_name>.set)
 # 4. Commits the backup file to Git so we have version history
+#    (or, inside the pipeline, leaves the commit to one batched commit at the end)
 #
 # Why we need this:
 # Before making any changes, we want a snapshot of the current config.
 # If something goes wrong, we can compare or rollback using these backups.
 
+import functools
+import hashlib
+import json
 import os
-import subprocess
-from pathlib import Path
+import threading
 
 from nautobot.apps.jobs import Job, ObjectVar, register_jobs
 from nautobot.dcim.models import Device
@@ -22,10 +25,172 @@ from nautobot.dcim.models import Device
 from nautobot.extras.choices import SecretsGroupAccessTypeChoices, SecretsGroupSecretTypeChoices
 from nautobot.extras.secrets.exceptions import SecretError
 
+from . import _device_state
+from ._device_info import device_info
+from ._git import commit_paths, defer_commit as git_defer_commit, head_matches, repo_dir, repo_info
+from ._netmiko_pool import POOL, ConnectHandler
+from ._secret_cache import get_cached_secret
+
 # Groups all related jobs together in the Nautobot UI
 name = "00_Vlan-Change-Jobs"
 
 
+# Protects backups/.hashes.json when several backups run in parallel threads
+_HASH_FILE_LOCK = threading.Lock()
+
+
+def _write_bytes(path, *chunks):
+    """
+    Write already-encoded chunks to a file.
+
+    Binary mode without buffering: no text codec wrapper and no extra copy, each
+    chunk goes straight to the OS.
+    """
+    with open(path, "wb", buffering=0) as f:
+        for chunk in chunks:
+            # An unbuffered write may be partial - keep going until the chunk is out
+            view = memoryview(chunk)
+            while view:
+                view = view[f.write(view):]
+
+
+def _load_hashes(hash_file):
+    """Read the device name -> sha256 map of the last backups (empty if missing or broken)."""
+    try:
+        return json.loads(hash_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _store_hash(hash_file, device_name, digest):
+    """Record the sha256 of a device's latest backup in the hash file."""
+    with _HASH_FILE_LOCK:
+        hashes = _load_hashes(hash_file)
+        hashes[device_name] = digest
+        try:
+            hash_file.write_text(json.dumps(hashes, indent=2, sort_keys=True), encoding="utf-8")
+        except OSError:
+            # Only a cache - worst case the next run writes and commits again
+            pass
+
+
+def build_device_params(device, driver, logger, log_prefix):
+    """
+    Resolve the Netmiko connection parameters (host + credentials) for a device.
+
+    Shared by the backup job and the pipeline, so the pipeline can open one SSH
+    session up front and hand it to every step instead of each step logging in again.
+
+    Args:
+        device: The Device object to connect to
+        driver: The Netmiko device_type (e.g. "juniper_junos")
+        logger: Logger to report problems to
+        log_prefix: Prefix for log lines, e.g. "[BackupDeviceConfig]"
+
+    Returns:
+        dict of ConnectHandler keyword arguments, or None if the device can't be reached
+    """
+
+    # Get the device's primary IP address
+    # We need this to know where to connect via SSH
+    # (platform, IP and secrets group come from one cached query, see _device_info.py)
+    info = device_info(device)
+    host = info.host
+
+    if host is None:
+        # No IP address configured, can't connect
+        logger.warning(
+            "%s Device %s has no primary IPv4 address configured. "
+            "Cannot establish SSH connection. Please assign a primary IP in Nautobot.",
+            log_prefix,
+            device.name,
+        )
+        return None
+
+    # --- Credential retrieval ---
+    # We need username and password to connect to the device
+    # We'll try multiple sources in order of preference:
+    # 1. Device's assigned Secrets Group (most secure, recommended)
+    # 2. Environment variables (fallback for testing/development)
+
+    username = None
+    password = None
+
+    # Try to get credentials from the device's Secrets Group
+    # This is the recommended way in production - credentials stored securely in Nautobot
+    secrets_group = info.secrets_group
+
+    if secrets_group:
+        try:
+            # Retrieve username and password from the secrets group
+            # Cached per process, so repeated runs for the same device don't
+            # go back to the secrets backend every time
+            username = get_cached_secret(
+                secrets_group,
+                SecretsGroupSecretTypeChoices.TYPE_USERNAME,
+                SecretsGroupAccessTypeChoices.TYPE_GENERIC,
+                device,
+            )
+            password = get_cached_secret(
+                secrets_group,
+                SecretsGroupSecretTypeChoices.TYPE_PASSWORD,
+                SecretsGroupAccessTypeChoices.TYPE_GENERIC,
+                device,
+            )
+            logger.info(
+                "%s Successfully retrieved credentials from "
+                "SecretsGroup '%s' for device %s.",
+                log_prefix,
+                secrets_group.name,
+                device.name,
+            )
+        except SecretError as e:
+            # Secrets Group exists but we couldn't get the credentials
+            logger.error(
+                "%s Failed to retrieve credentials from SecretsGroup "
+                "'%s' for device %s: %s",
+                log_prefix,
+                secrets_group.name,
+                device.name,
+                e,
+            )
+
+    # Fallback to environment variables if Secrets Group didn't work
+    # This is useful for development/testing but not recommended for production
+    if not username or not password:
+        env_user = os.environ.get("NETMIKO_USERNAME")
+        env_pass = os.environ.get("NETMIKO_PASSWORD")
+
+        if env_user and env_pass:
+            username = env_user
+            password = env_pass
+            logger.info(
+                "%s Using fallback credentials from environment variables "
+                "(NETMIKO_USERNAME and NETMIKO_PASSWORD).",
+                log_prefix,
+            )
+
+    # Final check - do we have credentials from anywhere?
+    if not username or not password:
+        logger.error(
+            "%s No credentials found. Tried: "
+            "1) Device's SecretsGroup, 2) Environment variables (NETMIKO_USERNAME/PASSWORD). "
+            "Cannot connect to the device without credentials.",
+            log_prefix,
+        )
+        return None
+
+    # Build the connection parameters for Netmiko
+    return {
+        "device_type": driver,  # juniper_junos
+        "host": host,  # Device IP address
+        "username": username,
+        "password": password,
+        "timeout": 30,  # Connection timeout in seconds
+        "banner_timeout": 15,  # Time to wait for login banner
+    }
+
+
 class BackupDeviceConfig(Job):
     """
     Step 1 of the pipeline: Backup current device configuration.
@@ -56,273 +221,354 @@ class BackupDeviceConfig(Job):
     REPO_ENV_VAR = "POC_NETOPS_REPO"  # Environment variable name
     DEFAULT_REPO_PATH = "/opt/nautobot/git/poc_netops"  # Fallback path if env var not set
     BACKUP_DIR_NAME = "backups"  # Subdirectory inside repo for backups
+    HASH_FILE_NAME = ".hashes.json"  # Per-device SHA-256 of the last backup (inside BACKUP_DIR_NAME)
+    OOB_DIR_NAME = "backups_oob"  # Untracked folder for very large backups (see below)
+    OOB_THRESHOLD_BYTES = 1024 * 1024  # Backups bigger than this are stored out-of-band
+    ALLOW_EMPTY_COMMIT = False  # Commit even when the backup is unchanged (audit trail of runs)
+
+    # How we read the config from the device
+    # No expect_string: Netmiko then waits for the session's own prompt
+    # (re.escape(base_prompt), e.g. "admin@sw1"). A looser pattern such as "ends
+    # in > or #" also matches config lines (descriptions, annotations) and would
+    # stop reading early - a truncated backup. TextFSM parsing is skipped entirely.
+    SEND_COMMAND_ARGS = {
+        "read_timeout": 60,  # Large configs can take a while to print
+        "strip_prompt": True,
+        "strip_command": True,
+        "use_textfsm": False,
+    }
+
+    @classmethod
+    def _repo_root(cls):
+        """Repository location for this job, resolved once per process (see _git.repo_info)."""
+        return repo_info(cls.REPO_ENV_VAR, cls.DEFAULT_REPO_PATH)
+
+    def run(self, device, interface=None, vlan=None, conn=None, defer_commit=False, **kwargs):
+        """Run the backup (see do_backup - the pipeline calls that directly)."""
+        do_backup(self.logger, device, interface=interface, vlan=vlan, conn=conn, defer_commit=defer_commit)
+
+
+def do_backup(logger, device, interface=None, vlan=None, conn=None, defer_commit=False):
+    """
+    Back up the running config of one device (the body of BackupDeviceConfig.run).
+
+    Args:
+        logger: Logger to write to (the calling job's self.logger)
+        device: The Device object to backup (required)
+        interface: Not used in backup, but passed through from pipeline
+        vlan: Not used in backup, but passed through from pipeline
+        conn: Already-open Netmiko session from the pipeline (optional).
+              If given, we use it instead of opening our own SSH connection.
+        defer_commit: False, or a batch from _git.new_batch(): then only write the
+                      file, register it in that batch and leave the git commit to
+                      the caller (see _git.flush_pending). Used by ConfigPipeline.
+    """
 
-    def run(self, device, interface=None, vlan=None, **kwargs):
-        """
-        Main execution method for the backup job.
-        
-        Args:
-            device: The Device object to backup (required)
-            interface: Not used in backup, but passed through from pipeline
-            vlan: Not used in backup, but passed through from pipeline
-            **kwargs: Additional arguments (ignored)
-        """
-        
-        self.logger.info(
-            f"[BackupDeviceConfig] Starting configuration backup for device {device.name} "
-            f"(database ID: {device.pk})."
-        )
-
-        # Import Netmiko lazily (only when we actually need it)
-        # This prevents import errors if netmiko isn't installed, and keeps startup faster
-        try:
-            from netmiko import ConnectHandler
-        except ModuleNotFoundError:
-            self.logger.error(
-                "[BackupDeviceConfig] The 'netmiko' library is not installed in the "
-                "Nautobot environment. Cannot backup device configuration. "
-                "Please install netmiko: pip install netmiko"
-            )
-            return
-        except Exception as e:
-            self.logger.error(
-                f"[BackupDeviceConfig] Unexpected error while importing netmiko: {e}"
-            )
-            return
-
-        # Determine where our Git repository is located
-        # First check environment variable, then fall back to default
-        repo_root = os.environ.get(self.REPO_ENV_VAR, self.DEFAULT_REPO_PATH)
-        repo_root = Path(repo_root)  # Convert to Path object for easier manipulation
-        self.logger.info(f"[BackupDeviceConfig] Using Git repository at: {repo_root}")
-
-        # Validate that the repo actually exists
-        if not repo_root.exists():
-            self.logger.error(
-                f"[BackupDeviceConfig] Git repository path {repo_root} does not exist. "
-                f"Please create it or set the {self.REPO_ENV_VAR} environment variable correctly."
-            )
-            return
+    logger.info(
+        "[BackupDeviceConfig] Starting configuration backup for device %s "
+        "(database ID: %s).",
+        device.name,
+        device.pk,
+    )
 
-        # Check device platform to ensure it's a Juniper device
-        # This PoC only supports Juniper JunOS devices
-        platform = getattr(device, "platform", None)
-        driver = getattr(platform, "network_driver", None)
+    # Netmiko is imported once when _netmiko_pool is loaded - here we only check
+    # whether that worked (a plain None check instead of an import per run)
+    if ConnectHandler is None:
+        logger.error(
+            "[BackupDeviceConfig] The 'netmiko' library is not installed in the "
+            "Nautobot environment. Cannot backup device configuration. "
+            "Please install netmiko: pip install netmiko"
+        )
+        return
+
+    # Determine where our Git repository is located
+    # First check environment variable, then fall back to default
+    # (resolved once per worker process, not on every run)
+    repo = BackupDeviceConfig._repo_root()
+    repo_root = repo.root
+    logger.info("[BackupDeviceConfig] Using Git repository at: %s", repo_root)
+
+    # Validate that the repo actually exists
+    if not repo.exists:
+        logger.error(
+            "[BackupDeviceConfig] Git repository path %s does not exist. "
+            "Please create it or set the %s environment variable correctly.",
+            repo_root,
+            BackupDeviceConfig.REPO_ENV_VAR,
+        )
+        return
+
+    # Check device platform to ensure it's a Juniper device
+    # This PoC only supports Juniper JunOS devices - the supported drivers are the
+    # keys of _BACKUP_HANDLERS, so the check is a single dict lookup
+    driver = device_info(device).driver
+    handler = _BACKUP_HANDLERS.get(driver)
+
+    if handler is None:
+        # Not a Juniper device, skip backup for this PoC
+        logger.info(
+            "[BackupDeviceConfig] Device %s has network driver '%s', "
+            "not 'juniper_junos'. Skipping backup (this PoC only supports Juniper devices).",
+            device.name,
+            driver,
+        )
+        return
 
-        if driver != "juniper_junos":
-            # Not a Juniper device, skip backup for this PoC
-            self.logger.info(
-                f"[BackupDeviceConfig] Device {device.name} has network driver '{driver}', "
-                f"not 'juniper_junos'. Skipping backup (this PoC only supports Juniper devices)."
-            )
-            return
+    handler(logger, device, repo, conn=conn, defer_commit=defer_commit)
 
-        # Get the device's primary IP address
-        # We need this to know where to connect via SSH
-        primary_ip = getattr(device, "primary_ip4", None)
-        
-        if primary_ip is None:
-            # No IP address configured, can't connect
-            self.logger.warning(
-                f"[BackupDeviceConfig] Device {device.name} has no primary IPv4 address configured. "
-                f"Cannot establish SSH connection. Please assign a primary IP in Nautobot."
-            )
-            return
 
-        # Extract just the IP address (without the subnet mask)
-        host = str(primary_ip.address.ip)
+def _oob_pointer(digest, size):
+    """The pointer file committed instead of an out-of-band backup (bytes)."""
+    return (
+        "version poc-netops-oob/1\n"
+        f"oid sha256:{digest}\n"
+        f"size {size}\n"
+        f"path {BackupDeviceConfig.OOB_DIR_NAME}/{digest}\n"
+    ).encode("utf-8")
 
-        # --- Credential retrieval ---
-        # We need username and password to connect to the device
-        # We'll try multiple sources in order of preference:
-        # 1. Device's assigned Secrets Group (most secure, recommended)
-        # 2. Environment variables (fallback for testing/development)
-        
-        username = None
-        password = None
 
-        # Try to get credentials from the device's Secrets Group
-        # This is the recommended way in production - credentials stored securely in Nautobot
-        secrets_group = getattr(device, "secrets_group", None)
-        
-        if secrets_group:
-            try:
-                # Retrieve username from the secrets group
-                username = secrets_group.get_secret_value(
-                    secret_type=SecretsGroupSecretTypeChoices.TYPE_USERNAME,
-                    access_type=SecretsGroupAccessTypeChoices.TYPE_GENERIC,
-                    obj=device,
-                )
-                # Retrieve password from the secrets group
-                password = secrets_group.get_secret_value(
-                    secret_type=SecretsGroupSecretTypeChoices.TYPE_PASSWORD,
-                    access_type=SecretsGroupAccessTypeChoices.TYPE_GENERIC,
-                    obj=device,
-                )
-                self.logger.info(
-                    f"[BackupDeviceConfig] Successfully retrieved credentials from "
-                    f"SecretsGroup '{secrets_group.name}' for device {device.name}."
-                )
-            except SecretError as e:
-                # Secrets Group exists but we couldn't get the credentials
-                self.logger.error(
-                    f"[BackupDeviceConfig] Failed to retrieve credentials from SecretsGroup "
-                    f"'{secrets_group.name}' for device {device.name}: {e}"
-                )
+def _backup_device(logger, device, repo, conn=None, defer_commit=False, *, driver, cmd):
+    """
+    Driver-specific part of do_backup: fetch the config, write it and commit it.
 
-        # Fallback to environment variables if Secrets Group didn't work
-        # This is useful for development/testing but not recommended for production
-        if not username or not password:
-            env_user = os.environ.get("NETMIKO_USERNAME")
-            env_pass = os.environ.get("NETMIKO_PASSWORD")
-            
-            if env_user and env_pass:
-                username = env_user
-                password = env_pass
-                self.logger.info(
-                    "[BackupDeviceConfig] Using fallback credentials from environment variables "
-                    "(NETMIKO_USERNAME and NETMIKO_PASSWORD)."
+    Not called directly - _BACKUP_HANDLERS holds one pre-bound copy per supported
+    driver (driver and command already filled in), so nothing driver-related has
+    to be looked up or decided again per device.
+    """
+    repo_root = repo.root
+
+    # --- Resolve connection parameters ---
+    # When the pipeline hands us an already-open session we skip the whole
+    # IP/credential lookup - the pipeline has done that once for all steps
+    if conn is None:
+        device_params = build_device_params(device, driver, logger, "[BackupDeviceConfig]")
+        if device_params is None:
+            return
+        host = device_params["host"]
+    else:
+        host = conn.host
+
+    # --- Connect to device and get configuration ---
+    # cmd comes from _BACKUP_HANDLERS, e.g. "show configuration | display set"
+    # for Junos (set format is easier to diff and track in version control)
+    try:
+        if conn is not None:
+            # Reuse the session opened by the pipeline (the pipeline closes it)
+            logger.info(
+                "[BackupDeviceConfig] Reusing pipeline SSH session to %s. "
+                "Running command on device: '%s'",
+                host,
+                cmd,
+            )
+            output = conn.send_command(cmd, **BackupDeviceConfig.SEND_COMMAND_ARGS)
+        else:
+            logger.info(
+                "[BackupDeviceConfig] Connecting to device %s at %s via SSH "
+                "to retrieve current configuration...",
+                device.name,
+                host,
+            )
+            # Borrow a connection from the process-wide pool - if an earlier job
+            # already logged in to this device, we skip the SSH handshake entirely.
+            # The context manager hands it back (or closes it if something failed).
+            with POOL.acquire(device_params) as new_conn:
+                logger.info(
+                    "[BackupDeviceConfig] Running command on device: '%s'",
+                    cmd,
                 )
-
-        # Final check - do we have credentials from anywhere?
-        if not username or not password:
-            self.logger.error(
-                "[BackupDeviceConfig] No credentials found. Tried: "
-                "1) Device's SecretsGroup, 2) Environment variables (NETMIKO_USERNAME/PASSWORD). "
-                "Cannot backup configuration without credentials."
+                output = new_conn.send_command(cmd, **BackupDeviceConfig.SEND_COMMAND_ARGS)
+
+    except Exception as e:
+        # Connection or command execution failed
+        logger.error(
+            "[BackupDeviceConfig] Failed to retrieve configuration from device "
+            "%s (%s). Error: %s",
+            device.name,
+            host,
+            e,
+        )
+        return
+
+    # Validate that we actually got some configuration data
+    # Empty or very short output usually means something went wrong
+    if not output or len(output) < 50:
+        logger.warning(
+            "[BackupDeviceConfig] Retrieved configuration seems suspiciously short "
+            "(%s characters). This might indicate a connection problem or "
+            "that the device returned an error.",
+            len(output),
+        )
+        # Continue anyway - maybe it's a very minimal config
+
+    # The backup is the device's real state: note the access VLAN of each port, so
+    # a push of the same VLAN right after this can be skipped (see _device_state.py)
+    if driver == "juniper_junos" and output:
+        _device_state.learn_from_set_config(device.pk, output)
+
+    # --- Save configuration to file ---
+    # Create the backups directory if it doesn't exist
+    # (repo_info already listed the repository, so usually there's nothing to do)
+    backup_dir = repo_dir(repo, BackupDeviceConfig.BACKUP_DIR_NAME)
+
+    # Create filename based on device name
+    # Format: <device_name>.set
+    backup_file = backup_dir / f"{device.name}.set"
+
+    # The bytes we store: the configuration plus a trailing newline for consistent formatting.
+    # We encode once and write the newline separately instead of building output + "\n"
+    # first - for multi-MB configs that saves another full copy of the string.
+    data = output.encode("utf-8")
+    size = len(data) + 1
+    hasher = hashlib.sha256(data)
+    hasher.update(b"\n")
+    digest = hasher.hexdigest()
+    pointer = None
+
+    # --- Skip unchanged backups ---
+    # If the config is identical to the last backup we took, writing the file and
+    # running git again only produces churn. We remember the SHA-256 of each
+    # device's last backup in backups/.hashes.json (not committed, just a cache).
+    # The hash is written as soon as the file is, before its commit - a commit that
+    # failed (or a deferred one that never ran) would then be skipped forever. So
+    # we only skip if HEAD holds those very bytes too (None = git can't tell us,
+    # then the file on disk has to do).
+    hash_file = backup_dir / BackupDeviceConfig.HASH_FILE_NAME
+    known_hashes = _load_hashes(hash_file)
+    if (
+        not BackupDeviceConfig.ALLOW_EMPTY_COMMIT
+        and known_hashes.get(device.name) == digest
+        and backup_file.exists()
+    ):
+        committed = (
+            head_matches(
+                repo_root,
+                backup_file.relative_to(repo_root),
+                _oob_pointer(digest, size) if size > BackupDeviceConfig.OOB_THRESHOLD_BYTES else data + b"\n",
             )
-            return
-
-        # Build the connection parameters for Netmiko
-        device_params = {
-            "device_type": driver,  # juniper_junos
-            "host": host,  # Device IP address
-            "username": username,
-            "password": password,
-            "timeout": 30,  # Connection timeout in seconds
-            "banner_timeout": 15,  # Time to wait for login banner
-        }
-
-        # --- Connect to device and get configuration ---
-        self.logger.info(
-            f"[BackupDeviceConfig] Connecting to device {device.name} at {host} via SSH "
-            f"to retrieve current configuration..."
+            if repo.is_git
+            else None
         )
-        
-        try:
-            # Use context manager to ensure connection is properly closed
-            with ConnectHandler(**device_params) as conn:
-                # Run the backup command
-                # "show configuration | display set" gives us the config in set format
-                # This format is easier to diff and track in version control
-                cmd = "show configuration | display set"
-                self.logger.info(
-                    f"[BackupDeviceConfig] Running command on device: '{cmd}'"
-                )
-                output = conn.send_command(cmd)
-                
-        except Exception as e:
-            # Connection or command execution failed
-            self.logger.error(
-                f"[BackupDeviceConfig] Failed to retrieve configuration from device "
-                f"{device.name} ({host}). Error: {e}"
+        if committed is not False:
+            logger.info(
+                "[BackupDeviceConfig] Configuration of %s is unchanged since the last "
+                "backup (sha256 %s). Skipping write and git commit.",
+                device.name,
+                digest[:12],
             )
             return
+        logger.info(
+            "[BackupDeviceConfig] Configuration of %s is unchanged, but the last "
+            "backup never made it into a commit. Committing it now.",
+            device.name,
+        )
 
-        # Validate that we actually got some configuration data
-        # Empty or very short output usually means something went wrong
-        if not output or len(output) < 50:
-            self.logger.warning(
-                f"[BackupDeviceConfig] Retrieved configuration seems suspiciously short "
-                f"({len(output)} characters). This might indicate a connection problem or "
-                f"that the device returned an error."
-            )
-            # Continue anyway - maybe it's a very minimal config
-
-        # --- Save configuration to file ---
-        # Create the backups directory if it doesn't exist
-        backup_dir = repo_root / self.BACKUP_DIR_NAME
-        backup_dir.mkdir(parents=True, exist_ok=True)
-
-        # Create filename based on device name
-        # Format: <device_name>.set
-        backup_file = backup_dir / f"{device.name}.set"
-        
+    # Very large configs (big chassis) go out-of-band: Git would otherwise hash and
+    # pack megabytes on every commit. We keep the full file in an untracked folder,
+    # named by its SHA-256, and commit only a small pointer file (like Git LFS does).
+    if size > BackupDeviceConfig.OOB_THRESHOLD_BYTES:
+        oob_dir = repo_root / BackupDeviceConfig.OOB_DIR_NAME
+        oob_file = oob_dir / digest
         try:
-            # Write the configuration to the file
-            # We add a newline at the end for consistent formatting
-            backup_file.write_text(output + "\n", encoding="utf-8")
-            self.logger.info(
-                f"[BackupDeviceConfig] Successfully wrote backup configuration to {backup_file} "
-                f"({len(output)} characters)."
-            )
+            oob_dir.mkdir(parents=True, exist_ok=True)
+            if not oob_file.exists():
+                # Same content = same name, so an existing file is already correct
+                _write_bytes(oob_file, data, b"\n")
         except Exception as e:
-            self.logger.error(
-                f"[BackupDeviceConfig] Failed to write backup file {backup_file}: {e}"
+            logger.error(
+                "[BackupDeviceConfig] Failed to write out-of-band backup %s: %s",
+                oob_file,
+                e,
             )
             return
 
-        # --- Commit to Git ---
-        # Check if this directory is actually a Git repository
-        git_dir = repo_root / ".git"
-        if not git_dir.exists():
-            self.logger.warning(
-                f"[BackupDeviceConfig] Directory {repo_root} is not a Git repository "
-                f"(no .git directory found). Skipping git commit. "
-                f"Initialize git: cd {repo_root} && git init"
-            )
-            return
-
-        # Get the relative path for git commands
-        # Git works better with relative paths from the repo root
-        rel_backup_path = backup_file.relative_to(repo_root)
+        logger.info(
+            "[BackupDeviceConfig] Backup is %s bytes (over the "
+            "%s byte limit). Stored full config in %s, "
+            "committing a pointer file instead.",
+            size,
+            BackupDeviceConfig.OOB_THRESHOLD_BYTES,
+            oob_file,
+        )
+        pointer = _oob_pointer(digest, size)
+
+    try:
+        # Write the configuration (or the pointer) to the file
+        if pointer is None:
+            _write_bytes(backup_file, data, b"\n")
+        else:
+            _write_bytes(backup_file, pointer)
+        logger.info(
+            "[BackupDeviceConfig] Successfully wrote backup configuration to %s (%s characters).",
+            backup_file,
+            len(output),
+        )
+    except Exception as e:
+        logger.error(
+            "[BackupDeviceConfig] Failed to write backup file %s: %s",
+            backup_file,
+            e,
+        )
+        return
+
+    # Remember what we just wrote, so the next run can skip an unchanged config
+    _store_hash(hash_file, device.name, digest)
+
+    # --- Commit to Git ---
+    # Check if this directory is actually a Git repository
+    if not repo.is_git:
+        logger.warning(
+            "[BackupDeviceConfig] Directory %s is not a Git repository "
+            "(no .git directory found). Skipping git commit. "
+            "Initialize git: cd %s && git init",
+            repo_root,
+            repo_root,
+        )
+        return
+
+    # Get the relative path for git commands
+    # Git works better with relative paths from the repo root
+    rel_backup_path = backup_file.relative_to(repo_root)
+
+    # We create a descriptive commit message that includes the device name
+    commit_msg = f"Backup config for device {device.name}"
+
+    if defer_commit:
+        # The caller (ConfigPipeline) commits all written files at the end in
+        # one git add + git commit, so we only register the file here
+        git_defer_commit(repo_root, rel_backup_path, commit_msg, batch=defer_commit)
+        logger.info(
+            "[BackupDeviceConfig] Backup file %s registered for the "
+            "pipeline's batched git commit.",
+            rel_backup_path,
+        )
+    else:
+        # Standalone run: stage and commit right away
+        # Set ALLOW_EMPTY_COMMIT = True to get a commit even if the config didn't change
+        # (an audit trail showing when backups were taken)
+        commit_paths(
+            repo_root,
+            [rel_backup_path],
+            commit_msg,
+            logger,
+            "[BackupDeviceConfig]",
+            allow_empty=BackupDeviceConfig.ALLOW_EMPTY_COMMIT,
+        )
 
-        try:
-            # Stage the backup file for commit
-            self.logger.info(
-                f"[BackupDeviceConfig] Running 'git add {rel_backup_path}' to stage backup file."
-            )
-            add_proc = subprocess.run(
-                ["git", "-C", str(repo_root), "add", str(rel_backup_path)],
-                capture_output=True,  # Capture stdout and stderr
-                text=True,  # Return strings instead of bytes
-                check=False,  # Don't raise exception on non-zero exit
-            )
-            # Log the result of git add
-            self.logger.info(
-                f"[BackupDeviceConfig] git add completed with exit code {add_proc.returncode}. "
-                f"Output: '{add_proc.stdout.strip()}' | Errors: '{add_proc.stderr.strip()}'"
-            )
+    logger.info(
+        "[BackupDeviceConfig] Backup process completed successfully for device %s.",
+        device.name,
+    )
 
-            # Commit the staged changes
-            # We create a descriptive commit message that includes the device name
-            commit_msg = f"Backup config for device {device.name}"
-            self.logger.info(
-                f"[BackupDeviceConfig] Running 'git commit -m \"{commit_msg}\"' to commit backup."
-            )
-            commit_proc = subprocess.run(
-                ["git", "-C", str(repo_root), "commit", "--allow-empty", "-m", commit_msg],
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-            # Log the result of git commit
-            self.logger.info(
-                f"[BackupDeviceConfig] git commit completed with exit code {commit_proc.returncode}. "
-                f"Output: '{commit_proc.stdout.strip()}' | Errors: '{commit_proc.stderr.strip()}'"
-            )
-            
-            # Note: We use --allow-empty so we get a commit even if the config didn't change
-            # This gives us an audit trail showing when backups were taken, even if nothing changed
-            
-        except Exception as e:
-            self.logger.error(
-                f"[BackupDeviceConfig] Error during git operations in {repo_root}: {e}"
-            )
 
-        self.logger.info(
-            f"[BackupDeviceConfig] Backup process completed successfully for device {device.name}."
-        )
+# Supported drivers -> backup function with driver and command baked in.
+# Adding a platform is one more entry here (plus its template).
+_BACKUP_HANDLERS = {
+    "juniper_junos": functools.partial(
+        _backup_device,
+        driver="juniper_junos",
+        cmd="show configuration | display set",
+    ),
+}
 
 
 # Register this job so Nautobot can discover and run it
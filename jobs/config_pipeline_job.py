@@ -5,8 +5,10 @@
 # What it does:
 # 1. Calls the Backup job to save current device config
 # 2. Calls the Intended Config job to render what config should look like
+#    (in a helper thread next to backup and push - neither of them needs its file)
 # 3. Calls the Push job to send config changes to the device
-# 4. Optionally runs "git push" at the end to sync to remote repository
+# 4. Optionally queues a "git push" at the end to sync to remote repository
+#    (runs in the background, the job doesn't wait for it)
 #
 # Why we need this:
 # This ties everything together into one automated workflow. When a VLAN changes
@@ -17,19 +19,41 @@
 # - Track everything in Git (audit trail)
 #
 # The pipeline can be triggered manually or automatically by the Socket sync job hook.
+# BulkConfigPipeline runs the same pipeline for many devices in parallel and
+# commits the files of all devices in a single git commit at the end.
+# run_coalesced() is what the job hook uses: a burst of triggers for the same
+# device collapses into one run (plus at most one follow-up run that pushes all
+# ports changed in the meantime together).
+#
+# Tuning (environment variable):
+#   PIPELINE_DEBOUNCE - seconds run_coalesced waits before a run starts, so a burst
+#                       of edits (fixing a typo right away) is pushed as one
+#                       (default 2, 0 = start at once)
 
+import json
+import logging
 import os
-import subprocess
-from pathlib import Path
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 
-from nautobot.apps.jobs import Job, ObjectVar, register_jobs
-from nautobot.dcim.models import Device
+from django.core.cache import cache
+from django.db import connection
+from nautobot.apps.jobs import Job, MultiObjectVar, ObjectVar, register_jobs
+from nautobot.dcim.models import Device, Interface
 
-# Import the individual jobs that make up our pipeline
-# These are relative imports from the same package
-from .backup_config_job import BackupDeviceConfig
-from .intended_config_job import BuildIntendedConfig
-from .push_config_job import PushConfigToDevice
+# Import the steps that make up our pipeline
+# These are relative imports from the same package. We import the plain do_*
+# functions instead of the Job classes: creating a Job instance per step (and
+# patching its logger) is pure overhead when all we want is to run its code.
+from ._device_info import device_info
+from ._git import enqueue_push, flush_pending, new_batch, repo_info, submit as submit_git
+from ._netmiko_pool import POOL, ConnectHandler
+from ._task_log import task_logger
+from .backup_config_job import build_device_params, do_backup
+from .intended_config_job import do_intended
+from .push_config_job import do_push
 
 # Groups all related jobs together in the Nautobot UI
 name = "00_Vlan-Change-Jobs"
@@ -63,219 +87,606 @@ class ConfigPipeline(Job):
         description="Device to run the complete configuration pipeline for.",
     )
 
-    def run(self, device, interface=None, vlan=None, **kwargs):
-        """
-        Main execution method that orchestrates the entire pipeline.
-        
-        Args:
-            device: The Device object to process (required)
-            interface: The specific Interface that triggered this (optional, for context)
-            vlan: The VLAN being configured (optional, for context)
-            **kwargs: Additional arguments (ignored)
-            
-        The interface and vlan parameters are passed through to each sub-job for
-        context and logging purposes. They help us understand what triggered the
-        pipeline and what changes we're making.
-        """
-        
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-        self.logger.info(
-            f"[ConfigPipeline] Starting configuration pipeline for device {device.name} "
-            f"(database ID: {device.pk})"
-        )
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-        
-        # Log the context that triggered this pipeline
-        # This helps with debugging and understanding the audit trail
-        self.logger.info(
-            f"[ConfigPipeline] Pipeline context:"
-        )
-        self.logger.info(
-            f"  - Target device: {device.name}"
-        )
-        self.logger.info(
-            f"  - Interface: {interface.name if interface else 'N/A'}"
-        )
-        self.logger.info(
-            f"  - VLAN: {getattr(vlan, 'id', vlan) if vlan else 'N/A'}"
+    def run(self, device, interface=None, vlan=None, git_push=True, interfaces=None, **kwargs):
+        """Run the pipeline (see do_pipeline - BulkConfigPipeline calls that directly)."""
+        do_pipeline(
+            self.logger,
+            device,
+            interface=interface,
+            vlan=vlan,
+            git_push=git_push,
+            interfaces=interfaces,
         )
 
-        # --- STEP 1: BACKUP ---
-        # Before making any changes, save the current device configuration
-        # This gives us a rollback point if something goes wrong
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-        self.logger.info(
-            "[ConfigPipeline] STEP 1 of 3: Running device configuration backup"
-        )
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
+
+def _open_shared_connection(logger, device):
+    """
+    Open one Netmiko session to the device for all pipeline steps.
+
+    Returns:
+        The connected Netmiko session, or None. With None the sub-jobs simply
+        fall back to opening (or skipping) their own connection, so any failure
+        here is reported but never stops the pipeline.
+    """
+    # This PoC only talks to Juniper JunOS devices - the sub-jobs skip anything else
+    driver = device_info(device).driver
+    if driver != "juniper_junos":
+        return None
+
+    if ConnectHandler is None:
+        # Netmiko isn't installed - the sub-jobs report that themselves
+        return None
+
+    device_params = build_device_params(device, driver, logger, "[ConfigPipeline]")
+    if device_params is None:
+        return None
+
+    try:
+        # Borrow from the process-wide pool - may reuse a session from an earlier run
+        conn = POOL.checkout(device_params)
+    except Exception as e:
+        logger.warning(
+            "[ConfigPipeline] Could not open shared SSH session to %s: %s. "
+            "Each step will try to connect on its own.",
+            device_params["host"],
+            e,
         )
-        
-        # Create an instance of the backup job
-        backup_job = BackupDeviceConfig()
-        
-        # Share our logger so all output appears in the same log stream
-        # This makes it easier to follow the entire pipeline in one place
-        backup_job.logger = self.logger
-        
-        # Run the backup job with our device and context
-        backup_job.run(device=device, interface=interface, vlan=vlan)
-        
-        self.logger.info(
-            "[ConfigPipeline] Step 1 completed: Backup finished"
+        return None
+
+    logger.info(
+        "[ConfigPipeline] Opened shared SSH session to %s (%s) for backup and push.",
+        device.name,
+        device_params["host"],
+    )
+    return conn
+
+
+def _banner(logger, msg, *args):
+    """
+    Log one section header like "[ConfigPipeline] ===== STEP 3 of 3: ... =====".
+
+    Used to be three lines (separator, message, separator) for every section - the
+    same information in a third of the log volume. msg takes %-style args, so
+    nothing is formatted when DEBUG is filtered out.
+
+    DEBUG, not INFO: Nautobot stores every job log line as a JobLogEntry row (one
+    database insert each). What happened is in the summary line at the end.
+    """
+    logger.debug("[ConfigPipeline] ===== " + msg + " =====", *args)
+
+
+class _PrefixLogAdapter:
+    """
+    Wraps a logger and prefixes every message, e.g. with the device name or step.
+
+    When several devices (or pipeline steps) run in parallel their log lines
+    interleave - the prefix keeps them readable. Keyword arguments (like extra=...)
+    are passed through as-is.
+    """
+
+    def __init__(self, logger, prefix):
+        self._logger = logger
+        self._prefix = prefix
+        # "ok", "warning" or "error" - the worst thing logged through us (for the summary)
+        self.status = "ok"
+
+    def __getattr__(self, name):
+        # Anything we don't wrap (isEnabledFor, level, ...) goes to the real logger
+        return getattr(self._logger, name)
+
+    def debug(self, msg, *args, **kwargs):
+        self._logger.debug(self._prefix + str(msg), *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._logger.info(self._prefix + str(msg), *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        if self.status == "ok":
+            self.status = "warning"
+        self._logger.warning(self._prefix + str(msg), *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.status = "error"
+        self._logger.error(self._prefix + str(msg), *args, **kwargs)
+
+    def success(self, msg, *args, **kwargs):
+        self._logger.success(self._prefix + str(msg), *args, **kwargs)
+
+
+def _with_own_db_connection(fn, *args, **kwargs):
+    """
+    Run fn in a helper thread and close the thread's database connection afterwards.
+
+    Django gives every thread its own DB connection. Without closing it, each
+    pipeline run would leave one connection behind for the helper thread.
+    (connection.close(), not close_old_connections(): the latter keeps connections
+    younger than CONN_MAX_AGE open - 300 seconds in Nautobot's default settings)
+
+    Because the connection is per thread, so is any transaction: a step that writes
+    to the database from the helper thread must open its own transaction.atomic()
+    there - it is not covered by a transaction of the calling thread.
+    """
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        connection.close()
+
+
+def _flush_when_done(future, repo_root, logger, log_prefix, batch):
+    """On the git thread: wait until future (step 2) is done, then commit the run's batch."""
+    wait([future])
+    return flush_pending(repo_root, logger, log_prefix, batch=batch)
+
+
+def do_pipeline(
+    logger, device, interface=None, vlan=None, git_push=True, git_commit=True, interfaces=None, batch=None
+):
+    """
+    Run backup, intended and push for one device (the body of ConfigPipeline.run).
+
+    Args:
+        logger: Logger to write to (the calling job's self.logger)
+        device: The Device object to process (required)
+        interface: The specific Interface that triggered this (optional, for context)
+        vlan: The VLAN being configured (optional, for context)
+        git_push: Run "git push" at the end (BulkConfigPipeline pushes once itself)
+        git_commit: Commit the written files at the end. BulkConfigPipeline passes
+                    False and commits the files of all devices in one go instead
+                    (they stay registered in _git's deferred list until then).
+        interfaces: More Interfaces of the device to push in the same go (optional,
+                    see do_push - run_coalesced uses this for ports that changed
+                    while a run was in progress)
+        batch: The _git batch the written files are registered in. Only needed
+               with git_commit=False (the caller flushes it); otherwise the run
+               uses a batch of its own.
+    
+    The interface and vlan parameters are passed through to each sub-job for
+    context and logging purposes. They help us understand what triggered the
+    pipeline and what changes we're making.
+
+    The pipeline's own progress lines are DEBUG; at INFO it writes one
+    "[ConfigPipeline] summary={...}" line (JSON) at the end with the outcome
+    of every step.
+    """
+
+    started = time.monotonic()
+
+    # Step 2 and the git commit log from helper threads - bind the job's task id
+    # while we're still on the job's thread, or their lines never reach the
+    # JobResult (see _task_log.py)
+    logger = task_logger(logger)
+
+    _banner(
+        logger,
+        "Starting configuration pipeline for device %s (database ID: %s)",
+        device.name,
+        device.pk,
+    )
+
+    # The context that triggered this pipeline and the outcome of each step.
+    # Logged once at the end as a single line instead of a line per item: every
+    # job log line is a database insert in Nautobot.
+    # Step status: "ok", "warning" or "error" (worst thing the step logged),
+    # "not run" if we never got to it
+    vlan_id = getattr(vlan, "id", vlan) if vlan else None
+    summary = {
+        "device": device.name,
+        "interface": ", ".join(
+            i.name for i in ([interface] if interface is not None else []) + list(interfaces or [])
+        ) or None,
+        "vlan": vlan_id,
+        "backup": "not run",
+        "intended": "not run",
+        "push": "not run",
+        "git": "not run",
+    }
+
+    # Locate the Git repository (needed for the batched commit and git push)
+    repo = repo_info()
+    repo_root = repo.root
+
+    # --- SHARED SSH SESSION ---
+    # Backup and Push both talk to the same device. Instead of letting each
+    # step log in on its own (SSH handshake + Junos CLI startup every time),
+    # we open one session here and hand it to both steps.
+    conn = _open_shared_connection(logger, device)
+    commit_future = None
+    intended_future = None
+    git_log = _PrefixLogAdapter(logger, "")  # only there to see whether the commit went wrong
+    # The deferred files of THIS run (see _git.new_batch) - a caller committing
+    # for several runs at once (BulkConfigPipeline) passes its own
+    if batch is None:
+        batch = new_batch()
+
+    try:
+        # --- STEP 1 + 2: BACKUP and BUILD INTENDED CONFIG (side by side) ---
+        # The backup mostly waits for the device to send its config, building the
+        # intended config is database + Jinja work. They don't depend on each other,
+        # so we build the intended config in a helper thread while the backup runs.
+        # Push (step 3) renders its own commands and never reads the intended file,
+        # so it doesn't wait for step 2 either - we only join step 2 at the very end.
+        _banner(
+            logger,
+            "STEP 1+2 of 3: Running device configuration backup "
+            "and building intended configuration in parallel",
         )
 
-        # --- STEP 2: BUILD INTENDED CONFIG ---
-        # Generate what the configuration SHOULD look like based on Nautobot data
+        # Step 2: Generate what the configuration SHOULD look like based on Nautobot data
         # This is our "desired state" derived from the source of truth
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-        self.logger.info(
-            "[ConfigPipeline] STEP 2 of 3: Building intended configuration"
-        )
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
+        # defer_commit: like the backup, the file is committed in the batch below
+        # Each step logs with its own prefix, since their lines now interleave
+        intended_log = _PrefixLogAdapter(logger, "[step 2] ")
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-intended")
+        intended_future = executor.submit(
+            _with_own_db_connection,
+            do_intended,
+            intended_log,
+            device,
+            interface=interface,
+            vlan=vlan,
+            defer_commit=batch,
         )
-        
-        # Create an instance of the intended config job
-        intended_job = BuildIntendedConfig()
-        
-        # Share our logger
-        intended_job.logger = self.logger
-        
-        # Run the intended config job
-        intended_job.run(device=device, interface=interface, vlan=vlan)
-        
-        self.logger.info(
-            "[ConfigPipeline] Step 2 completed: Intended config built"
+        # No more work for this executor - its thread ends once step 2 is done,
+        # we don't block on it here
+        executor.shutdown(wait=False)
+
+        # Step 1: Before making any changes, save the current device configuration
+        # This gives us a rollback point if something goes wrong
+        # Run the backup step with our logger, so all output appears in the
+        # same log stream (easier to follow the entire pipeline in one place)
+        # defer_commit: the backup file gets committed together with everything
+        # else at the end of the pipeline (one git add + one git commit)
+        backup_log = _PrefixLogAdapter(logger, "[step 1] ")
+        do_backup(
+            backup_log,
+            device,
+            interface=interface,
+            vlan=vlan,
+            conn=conn,
+            defer_commit=batch,
         )
+        summary["backup"] = backup_log.status
+        logger.debug("[ConfigPipeline] Step 1 completed: Backup finished")
+
+        # Commit on the background git thread while step 3 talks to the device,
+        # instead of waiting for git first. The git thread waits for step 2 to
+        # finish writing its file before it commits.
+        if git_commit:
+            commit_future = submit_git(
+                _flush_when_done, intended_future, repo_root, git_log, "[ConfigPipeline]", batch
+            )
 
         # --- STEP 3: PUSH CONFIG TO DEVICE ---
         # Send the configuration commands to the actual device
         # This makes the real-world device match our source of truth
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-        self.logger.info(
-            "[ConfigPipeline] STEP 3 of 3: Pushing configuration to device"
-        )
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-        
-        # Create an instance of the push job
-        push_job = PushConfigToDevice()
-        
-        # Share our logger
-        push_job.logger = self.logger
-        
-        # Run the push job
+        _banner(logger, "STEP 3 of 3: Pushing configuration to device")
+
+        # Run the push step with our logger
         # This is where the actual device configuration changes happen
-        push_job.run(device=device, interface=interface, vlan=vlan)
-        
-        self.logger.info(
-            "[ConfigPipeline] Step 3 completed: Configuration pushed to device"
-        )
+        push_log = _PrefixLogAdapter(logger, "[step 3] ")
+        do_push(push_log, device, interface=interface, vlan=vlan, conn=conn, interfaces=interfaces)
+        summary["push"] = push_log.status
+        logger.debug("[ConfigPipeline] Step 3 completed: Configuration pushed to device")
 
-        # --- PIPELINE COMPLETION ---
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-        self.logger.info(
-            f"[ConfigPipeline] Pipeline completed successfully for device {device.name}"
-        )
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
+        # Join step 2 (re-raises anything it raised). Also makes sure its file is
+        # written before we return - BulkConfigPipeline commits right after us.
+        intended_future.result()
+        summary["intended"] = intended_log.status
+        logger.debug("[ConfigPipeline] Step 2 completed: Intended config built")
+    except BaseException:
+        # A step failed half-way. Files already written are registered in our batch
+        # (step 2's too, once its thread is done) - commit them now instead of
+        # leaving them behind. A commit already started on the git thread does
+        # that itself; with git_commit=False the caller flushes the batch.
+        if intended_future is not None:
+            wait([intended_future])
+        if git_commit and commit_future is None and repo.is_git:
+            flush_pending(repo_root, git_log, "[ConfigPipeline]", batch=batch)
+        raise
+    finally:
+        # Hand the shared session back to the pool for the next run
+        if conn is not None:
+            POOL.release(conn)
+
+    # --- GIT COMMIT + OPTIONAL GIT PUSH ---
+    # At this point, we have:
+    # - Backed up the config (written, commit deferred to here)
+    # - Built intended config (written, commit deferred to here as well)
+    # - Pushed changes to device
+    # 
+    # First we commit the deferred files in one batch, then we can optionally
+    # push to a remote Git repository
+    # This syncs our local commits to a central server for team collaboration
+
+    # Check if this is actually a Git repository
+    if not repo.is_git:
+        logger.warning(
+            "[ConfigPipeline] Directory %s is not a Git repository "
+            "(no .git directory found). Skipping git push. "
+            "To initialize: cd %s && git init",
+            repo_root,
+            repo_root,
         )
+        summary["git"] = "not a git repository"
+    elif not git_commit:
+        # The caller commits (and pushes) everything at once
+        summary["git"] = "commit deferred to caller"
+    else:
+        # Wait for the batched commit started after step 2 - git push needs it.
+        # (it is always started when git_commit is set and no step raised)
+        committed = commit_future.result()
+        if git_log.status != "ok":
+            summary["git"] = "commit " + git_log.status
+        else:
+            summary["git"] = "committed" if committed else "nothing to commit"
 
-        # --- OPTIONAL: GIT PUSH ---
-        # At this point, we have:
-        # - Backed up the config (committed to Git)
-        # - Built intended config (committed to Git)
-        # - Pushed changes to device
-        # 
-        # Now we can optionally push to a remote Git repository
-        # This syncs our local commits to a central server for team collaboration
-        
-        # Locate the Git repository
-        repo_root = Path(
-            os.environ.get("POC_NETOPS_REPO", "/opt/nautobot/git/poc_netops")
+        # Bulk runs push once at the very end instead of once per device
+        # The push itself runs on a background thread - the job doesn't wait for the
+        # remote. Failures end up in the worker log and .git/poc-netops-push-failures.log.
+        if git_push:
+            # False = a push for this repository is already queued and will include our commit
+            if enqueue_push(repo_root):
+                summary["git"] += ", push queued"
+            else:
+                summary["git"] += ", joined queued push"
+
+    # --- PIPELINE COMPLETION ---
+    summary["seconds"] = round(time.monotonic() - started, 2)
+    if logger.isEnabledFor(logging.INFO):
+        # default=str: VLAN ids are UUIDs, which json can't serialize on its own
+        logger.info("[ConfigPipeline] summary=%s", json.dumps(summary, default=str))
+
+
+# How long a "pipeline is running" marker lives at most (seconds). Normally it is
+# removed when the run ends - this only matters if a worker dies mid-run.
+COALESCE_RUNNING_TTL = 600
+# How long a "changes arrived, run again" marker waits to be picked up (seconds).
+# It is only read when the running pipeline is done, so it has to outlive the
+# longest possible run - otherwise the ports in it are silently never pushed.
+COALESCE_PENDING_TTL = COALESCE_RUNNING_TTL
+
+
+# Short lock around reading + writing the pending list (seconds it may be held at most)
+COALESCE_LOCK_TTL = 5
+
+# Wait before a run starts (seconds) - edits made meanwhile join that run
+try:
+    COALESCE_DEBOUNCE = float(os.environ.get("PIPELINE_DEBOUNCE", 2))
+except ValueError:
+    COALESCE_DEBOUNCE = 2.0
+
+
+@contextmanager
+def _pending_lock(device_pk):
+    """
+    Hold configpipeline:pendinglock:<device> while the pending list is changed.
+
+    Raises RuntimeError if the lock can't be taken - the pending list is never
+    written without it (two writers would drop each other's ports).
+    """
+    lock_key = f"configpipeline:pendinglock:{device_pk}"
+    # Our own value in the lock, so we only ever remove a lock we hold
+    token = uuid.uuid4().hex
+    # cache.add is atomic - spin for up to twice the lock TTL: a lock left behind
+    # by a dead worker has expired by then, so only real contention times out
+    deadline = time.monotonic() + 2 * COALESCE_LOCK_TTL
+    while not cache.add(lock_key, token, COALESCE_LOCK_TTL):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Could not lock the pending pipeline list of device {device_pk}")
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        # Only delete it if it is still ours (it expires after COALESCE_LOCK_TTL,
+        # and may already belong to another worker then)
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def _add_pending(device_pk, interface_pk):
+    """Remember that interface_pk (None = just the device) changed during a run."""
+    pending_key = f"configpipeline:pending:{device_pk}"
+    with _pending_lock(device_pk):
+        pending = cache.get(pending_key) or []
+        if interface_pk not in pending:
+            pending.append(interface_pk)
+        cache.set(pending_key, pending, COALESCE_PENDING_TTL)
+
+
+def _take_pending(device_pk):
+    """Return and clear the pending list of a device (None if nothing is pending)."""
+    pending_key = f"configpipeline:pending:{device_pk}"
+    with _pending_lock(device_pk):
+        pending = cache.get(pending_key)
+        if pending is not None:
+            cache.delete(pending_key)
+    return pending
+
+
+def run_coalesced(logger, device, interface=None, vlan=None):
+    """
+    Run the pipeline, but collapse bursts of triggers for the same device.
+
+    The job hook fires for every interface save. If somebody edits a port several
+    times in quick succession, we don't want N full pipeline runs (N backups, N
+    pushes of the same state). Two markers in the Nautobot cache (Redis) handle that:
+
+    - configpipeline:running:<device> - a run is in progress
+    - configpipeline:pending:<device> - the interfaces (pks) that changed during that run
+
+    A trigger that finds a run in progress only adds its interface to the pending
+    list and returns. A run first waits COALESCE_DEBOUNCE seconds, so edits made
+    right after ours are pushed by the same run. The running pipeline checks the
+    list again when it is done and runs once more with the latest data from the
+    database - however many triggers arrived meanwhile. All interfaces in the list are pushed together in one send_config_set
+    (see do_push), so edits to several ports of a switch cost one extra run, not one each.
+
+    Returns:
+        True if this call ran the pipeline, False if it was handed to a running one
+    """
+    running_key = f"configpipeline:running:{device.pk}"
+    interface_pk = str(interface.pk) if interface is not None else None
+    extra = []
+
+    while True:
+        # cache.add is atomic: only one caller can create the running marker
+        if not cache.add(running_key, 1, COALESCE_RUNNING_TTL):
+            _add_pending(device.pk, interface_pk)
+            # Try once more - the other run may have finished in the meantime
+            # (then nobody would look at our pending list)
+            if not cache.add(running_key, 1, COALESCE_RUNNING_TTL):
+                logger.info(
+                    "[ConfigPipeline] A pipeline run for %s is already in progress. "
+                    "It will run once more afterwards to pick up this change.",
+                    device.name,
+                )
+                return False
+
+        try:
+            # Let a burst of edits settle - their triggers land in the pending list
+            if COALESCE_DEBOUNCE > 0:
+                time.sleep(COALESCE_DEBOUNCE)
+
+            # Whatever was pending is covered by the run we are about to start -
+            # its interfaces are pushed together with ours
+            pending = _take_pending(device.pk) or []
+            if interface_pk is not None and interface_pk in pending:
+                # Our own port was changed again meanwhile: push what the database
+                # holds now, not the VLAN we were triggered with (last edit wins)
+                interface = Interface.objects.select_related("untagged_vlan").get(pk=interface.pk)
+                vlan = interface.untagged_vlan
+            extra_pks = {pk for pk in pending if pk is not None and pk != interface_pk}
+            if extra_pks:
+                extra = list(
+                    Interface.objects.filter(pk__in=extra_pks, device=device).select_related("untagged_vlan")
+                )
+            do_pipeline(logger, device, interface=interface, vlan=vlan, interfaces=extra)
+        finally:
+            cache.delete(running_key)
+
+        if cache.get(f"configpipeline:pending:{device.pk}") is None:
+            return True
+
+        # More changes came in while we were running - the next round loads all
+        # pending interfaces fresh from the database (latest state)
+        logger.info(
+            "[ConfigPipeline] Changes for %s arrived during the run, running the pipeline once more.",
+            device.name,
         )
-        git_dir = repo_root / ".git"
+        interface, interface_pk, vlan, extra = None, None, None, []
 
-        # Check if this is actually a Git repository
-        if not git_dir.exists():
-            self.logger.warning(
-                f"[ConfigPipeline] Directory {repo_root} is not a Git repository "
-                f"(no .git directory found). Skipping git push. "
-                f"To initialize: cd {repo_root} && git init"
+
+class BulkConfigPipeline(Job):
+    """
+    Runs the configuration pipeline for many devices at once.
+
+    Each device goes through the normal pipeline (backup, intended, push),
+    but devices are processed in parallel threads. SSH and git are mostly waiting
+    on the network/disk, so N devices take roughly as long as the slowest few
+    instead of the sum of all of them.
+    """
+
+    class Meta:
+        name = "00_Bulk config pipeline (POC)"
+        description = "Runs the configuration pipeline for several devices in parallel."
+        commit_default = False
+
+    devices = MultiObjectVar(
+        model=Device,
+        required=True,
+        description="Devices to run the configuration pipeline for.",
+    )
+
+    # How many devices we work on at the same time
+    # SSH connections come from the shared pool, so devices aren't hit twice at once
+    MAX_WORKERS = 16
+
+    def _run_one(self, logger, device, batch):
+        """
+        Run the full pipeline for one device (called in a worker thread).
+
+        logger must already carry the job's task id (task_logger() in run) - on
+        this thread Celery can't find it, and the device's lines would be dropped.
+        """
+        try:
+            # No per-device git commit or push - we commit and push once when all devices are done
+            do_pipeline(
+                _PrefixLogAdapter(logger, f"[dev={device.name}] "),
+                device,
+                git_push=False,
+                git_commit=False,
+                batch=batch,
             )
-            return
+        finally:
+            # Django gives every thread its own DB connection - close ours when done
+            # (close_old_connections() would keep it open for CONN_MAX_AGE)
+            connection.close()
 
-        # Try to push to remote
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-        self.logger.info(
-            f"[ConfigPipeline] Running 'git push' to sync commits to remote repository"
-        )
-        self.logger.info(
-            f"[ConfigPipeline] Repository: {repo_root}"
-        )
+    def run(self, devices, **kwargs):
+        """
+        Fan the pipeline out over all selected devices, then commit and push to Git once.
+
+        Args:
+            devices: The Device objects to process
+            **kwargs: Additional arguments (ignored)
+        """
+        devices = list(devices)
+        workers = max(1, min(self.MAX_WORKERS, len(devices)))
         self.logger.info(
-            "[ConfigPipeline] =========================================="
+            "[BulkConfigPipeline] Running pipeline for %s device(s) "
+            "with %s parallel worker(s).",
+            len(devices),
+            workers,
         )
-        
-        try:
-            # Run git push command
-            push_proc = subprocess.run(
-                ["git", "-C", str(repo_root), "push"],
-                capture_output=True,  # Capture output for logging
-                text=True,  # Return strings instead of bytes
-                check=False,  # Don't raise exception on failure
+
+        # Bound to our task id here on the job's thread, see _run_one
+        logger = task_logger(self.logger)
+        # All devices register their files in this batch, committed once below
+        batch = new_batch()
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-pipeline") as executor:
+            futures = {executor.submit(self._run_one, logger, device, batch): device for device in devices}
+            for future in as_completed(futures):
+                device = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append(device.name)
+                    self.logger.error(
+                        "[BulkConfigPipeline] Pipeline for device %s failed: %s",
+                        device.name,
+                        e,
+                    )
+
+        # One git commit for the files of all devices: git's fixed cost per commit
+        # (index write, ref update, hooks) is paid once instead of once per device.
+        # Then one git push (in the background, see _git.enqueue_push)
+        repo = repo_info()
+        if repo.is_git:
+            job_result = getattr(self, "job_result", None)
+            run_label = f"Pipeline run {job_result.pk}" if job_result is not None else "Pipeline run"
+            flush_pending(
+                repo.root,
+                self.logger,
+                "[BulkConfigPipeline]",
+                batch=batch,
+                message=f"{run_label}: backup + intended config for {len(devices)} device(s)",
             )
-            
-            # Log the results
-            self.logger.info(
-                f"[ConfigPipeline] git push exit code: {push_proc.returncode}"
+            enqueue_push(repo.root)
+            self.logger.info("[BulkConfigPipeline] Queued 'git push' for %s in the background.", repo.root)
+
+        if failed:
+            self.logger.warning(
+                "[BulkConfigPipeline] Finished with %s failed device(s): %s",
+                len(failed),
+                ", ".join(failed),
             )
-            
-            if push_proc.returncode == 0:
-                # Success
-                self.logger.info(
-                    f"[ConfigPipeline] git push succeeded. Output: '{push_proc.stdout.strip()}'"
-                )
-            else:
-                # Failed - might be no remote configured, authentication issue, etc.
-                self.logger.warning(
-                    f"[ConfigPipeline] git push failed. This is not critical - commits are "
-                    f"still saved locally. Error: '{push_proc.stderr.strip()}'"
-                )
-                
-        except Exception as e:
-            # Command execution failed
-            self.logger.error(
-                f"[ConfigPipeline] Exception while running git push: {e}. "
-                f"Commits are still saved locally in {repo_root}."
+        else:
+            self.logger.info(
+                "[BulkConfigPipeline] Finished successfully for all %s device(s).",
+                len(devices),
             )
 
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-        self.logger.info(
-            "[ConfigPipeline] All pipeline operations completed"
-        )
-        self.logger.info(
-            "[ConfigPipeline] =========================================="
-        )
-
 
-# Register this job so Nautobot can discover and run it
-register_jobs(ConfigPipeline)
+# Register these jobs so Nautobot can discover and run them
+register_jobs(ConfigPipeline, BulkConfigPipeline)
@@ -4,112 +4,237 @@ from nautobot.dcim.models import Device, Interface
 from nautobot.ipam.models import VLAN
 from nautobot.extras.models import Status
 from django.contrib.contenttypes.models import ContentType
-from jinja2 import Template
-import os, re
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+import mmap, os, re, time
 
 name = "Custom Import from Config"  # Gruppierung im UI
 
+# Tokenizer fuer Junos-Configs im "curly"-Format: Strings in Anfuehrungszeichen,
+# die Zeichen { } ; oder sonstiger Text. Byte-Pattern: laeuft direkt auf dem mmap.
+_TOKEN_RE = re.compile(rb'"(?:[^"\\]|\\.)*"|[{};]|[^{};"]+')
+_GE_IFACE_RE = re.compile(rb"ge-\d+/\d+/\d+")
+
+# Kleinere Dateien einfach lesen - mmap lohnt sich erst bei grossen Configs
+_MMAP_MIN_BYTES = 256 * 1024
+
+
+def _last_line(text):
+    """Letzte nicht-leere Zeile ohne Kommentare (z.B. "## Last commit: ...")."""
+    for line in reversed(text.splitlines()):
+        line = line.strip()
+        if line and not line.startswith((b"#", b"/*")):
+            return line
+    return b""
+
+
+def _parse_junos(buf):
+    """
+    Junos-Config (bytes/mmap) in einem Durchlauf lesen (ohne DB, ohne Backtracking).
+
+    Laeuft einmal linear ueber die Tokens und merkt sich den Stanza-Stack:
+    - "vlan-id N;" -> VLAN mit dem Namen der umschliessenden Stanza
+    - in "ge-x/x/x { ... }": "interface-mode access;" und "vlan { members NAME; }"
+
+    Returns:
+        (vlan_map, vid_to_name, port_map) - name -> vid, vid -> name, ifname -> vlan name
+    """
+    vlan_map = {}  # name -> vid
+    vid_to_name = {}  # vid -> name (jede VLAN-ID nur einmal in die DB)
+    access_ports = {}  # ifname -> True (dict statt set: Reihenfolge wie in der Datei)
+    members = {}  # ifname -> vlan name
+
+    stack = []  # Stanza-Namen (bytes) von aussen nach innen
+    iface = None  # aktuelles ge-x/x/x (str) oder None
+    iface_depth = 0
+    pending = b""  # Text seit dem letzten { } ;
+
+    for tok in _TOKEN_RE.finditer(buf):
+        t = tok.group()
+        if t == b"{":
+            header = _last_line(pending)
+            stack.append(header)
+            if iface is None and _GE_IFACE_RE.fullmatch(header):
+                iface, iface_depth = header.decode("ascii"), len(stack)
+            pending = b""
+        elif t == b"}":
+            if stack:
+                stack.pop()
+            if iface is not None and len(stack) < iface_depth:
+                iface = None
+            pending = b""
+        elif t == b";":
+            words = _last_line(pending).split()
+            pending = b""
+            if len(words) != 2:
+                continue
+            key, value = words
+            if key == b"vlan-id" and stack and value.isdigit():
+                vname, vid = stack[-1].decode("ascii", "replace"), int(value)
+                vlan_map[vname] = vid
+                vid_to_name[vid] = vname
+            elif iface is not None:
+                if key == b"interface-mode" and value == b"access":
+                    access_ports[iface] = True
+                elif key == b"members" and stack and stack[-1] == b"vlan":
+                    members.setdefault(iface, value.decode("ascii", "replace"))
+        else:
+            pending += t
+
+    port_map = {ifname: members[ifname] for ifname in access_ports if ifname in members}
+    return vlan_map, vid_to_name, port_map
+
+# Active-Status pro Modell: nur die PK cachen, und nur kurz - wird der Status im UI
+# (anderer Prozess) geloescht/neu angelegt, holen wir ihn spaetestens nach der TTL neu
+_STATUS_TTL = 60.0
+_STATUS_CACHE = {}  # model -> (status pk, ablauf in time.monotonic())
+
+
+def _active_status_id(model):
+    """PK des Active-Status fuer model holen/anlegen (fuer _STATUS_TTL Sekunden aus dem Cache)."""
+    hit = _STATUS_CACHE.get(model)
+    if hit and hit[1] > time.monotonic():
+        return hit[0]
+    ct = ContentType.objects.get_for_model(model)
+    st = Status.objects.filter(content_types=ct, name__iexact="active").first()
+    if not st:
+        st = Status.objects.create(name="Active", color="green")
+        st.content_types.add(ct)
+    _STATUS_CACHE[model] = (st.pk, time.monotonic() + _STATUS_TTL)
+    return st.pk
+
+
+# Aenderungen in diesem Prozess (z.B. durch einen anderen Job) sofort wirksam machen
+@receiver([post_save, post_delete], sender=Status, dispatch_uid="poc_netops_import_active_status")
+def _status_changed(sender, instance, **kwargs):
+    _STATUS_CACHE.clear()
+
 class ImportJunosFromBackup(jobs.Job):
     """Junos-Backup einlesen, VLANs erstellen, Access-Ports (untagged VLAN) mappen."""
 
     device = jobs.ObjectVar(model=Device, description="Target device")
     repo_root = jobs.StringVar(default="/opt/nautobot/git/poc_netops", description="Backup repo root")
-    rel_path_tpl = jobs.StringVar(default="backups/{{ device.name }}.cfg", description="Jinja path to backup file")
+    rel_path_tpl = jobs.StringVar(
+        default="backups/{device_name}.cfg",
+        description="Path to backup file, e.g. backups/{device_name}.cfg or backups/{device.name}.cfg",
+    )
 
     class Meta:
         name = "Import Junos (VLANs & Access-Ports) from Backup"
         commit_default = True
 
-    def _get_or_create_active_status(self, model):
-        """Get or create Active status for given model."""
-        ct = ContentType.objects.get_for_model(model)
-        st = Status.objects.filter(content_types=ct, name__iexact="active").first()
-        if not st:
-            st = Status.objects.create(name="Active", color="green")
-            st.content_types.add(ct)
-        return st
-
     def run(self, *, device, repo_root, rel_path_tpl):
         # Datei aufloesen und laden
-        path = Template(rel_path_tpl).render(device=device)
+        # feste Platzhalter per str.replace (kein str.format: "{"/"}" im Pfad, kein Attribut-Zugriff
+        # aus der Job-Eingabe); alte Jinja-Pfade ("{{ device.name }}") gehen weiter
+        if "{{" in rel_path_tpl:
+            from jinja2 import Template  # erst hier importieren - nur fuer alte Jinja-Pfade
+            path = Template(rel_path_tpl).render(device=device)
+        else:
+            path = rel_path_tpl.replace("{device_name}", device.name).replace("{device.name}", device.name)
         fpath = os.path.join(repo_root, path)
         if not os.path.isfile(fpath):
-            self.logger.error(f"Backup file not found: {fpath}")
+            self.logger.error("Backup file not found: %s", fpath)
             return
 
-        with open(fpath, "r", encoding="utf-8", errors="ignore") as fh:
-            txt = fh.read()
+        # Grosse Dateien per mmap: kein Kopieren in den Heap, kein bytes->str fuer die ganze Datei
+        with open(fpath, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < _MMAP_MIN_BYTES:
+                vlan_map, vid_to_name, port_map = _parse_junos(fh.read())
+            else:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    vlan_map, vid_to_name, port_map = _parse_junos(buf)
 
         dev_loc = getattr(device, "location", None)    # Nautobot 2.x
-        vlan_status = self._get_or_create_active_status(VLAN)
-        interface_status = self._get_or_create_active_status(Interface)
-
-        # ---------- VLANs: überall Stanzas "NAME { ... vlan-id N; }" finden
-        created = updated = 0
-        vlan_map = {}  # name -> vid
-        for m in re.finditer(
-            r"^[ \t]*([A-Za-z0-9\-_]+)[ \t]*\{(?:(?!^\}).)*?vlan-id[ \t]+(\d+);",
-            txt, re.M | re.S
-        ):
-            vname, vid = m.group(1), int(m.group(2))
-            vlan_map[vname] = vid
-            qs = VLAN.objects.filter(vid=vid)
-            if dev_loc:
-                qs = qs.filter(location=dev_loc)
-            vlan = qs.first()
-            if not vlan:
-                payload = {"name": vname, "vid": vid, "status": vlan_status}
+        vlan_status_id = _active_status_id(VLAN)
+        interface_status_id = _active_status_id(Interface)
+
+        # ---------- Schreiben: alles in einer Transaktion (ein Commit statt einem pro Objekt)
+        with transaction.atomic():
+            # ---------- VLANs: eine Query fuer alle statt einer pro VLAN
+            def _load_vlans(vids):
+                qs = VLAN.objects.filter(vid__in=vids)
                 if dev_loc:
-                    payload["location"] = dev_loc
-                VLAN.objects.create(**payload)
-                created += 1
-            else:
+                    qs = qs.filter(location=dev_loc)
+                by_vid = {}
+                for v in qs:
+                    by_vid.setdefault(v.vid, v)  # wie frueher .first(): erster Treffer gewinnt
+                return by_vid
+
+            existing_vlans = _load_vlans(vid_to_name)
+
+            new_vlans, changed_vlans = [], []
+            for vid, vname in vid_to_name.items():
+                vlan = existing_vlans.get(vid)
+                if not vlan:
+                    payload = {"name": vname, "vid": vid, "status_id": vlan_status_id}
+                    if dev_loc:
+                        payload["location"] = dev_loc
+                    new_vlans.append(VLAN(**payload))
+                    continue
                 changed = False
                 if vlan.name != vname:
                     vlan.name = vname; changed = True
                 if not vlan.status_id:
-                    vlan.status = vlan_status; changed = True
+                    vlan.status_id = vlan_status_id; changed = True
                 if changed:
-                    vlan.save(); updated += 1
-        self.logger.info(f"VLANs parsed: {len(vlan_map)}; created: {created}, updated: {updated}")
-
-        # ---------- Interfaces: ge-x/x/x Blocks parsen, Access + untagged VLAN mappen
-        port_updates = 0
-        for ib in re.finditer(r"\n\s*(ge-\d+/\d+/\d+)\s*{(.*?)}\s*\n", txt, re.S):
-            ifname, ibody = ib.group(1), ib.group(2)
-            if "interface-mode access" not in ibody:
-                continue
-            m_vlan = re.search(r"vlan\s*{\s*members\s+([A-Za-z0-9\-_]+);", ibody)
-            if not m_vlan:
-                continue
-            vname = m_vlan.group(1)
-            vid = vlan_map.get(vname)
-            vlan_obj = None
-            if vid:
-                qs = VLAN.objects.filter(vid=vid)
-                if dev_loc:
-                    qs = qs.filter(location=dev_loc)
-                vlan_obj = qs.first()
-
-            iface = Interface.objects.filter(device=device, name=ifname).first()
-            if not iface:
-                iface = Interface.objects.create(
-                    device=device, 
-                    name=ifname, 
-                    type="other", 
-                    status=interface_status,  # ADD THIS
-                    enabled=True
-                )
-
-            changed = False
-            if hasattr(iface, "mode") and iface.mode != "access":
-                iface.mode = "access"; changed = True
-            if vlan_obj and getattr(iface, "untagged_vlan_id", None) != vlan_obj.id:
-                iface.untagged_vlan = vlan_obj; changed = True
-            if changed:
-                iface.save(); port_updates += 1
-
-        self.logger.info(f"Ports updated: {port_updates}")
+                    changed_vlans.append(vlan)
+
+            # Einzeln speichern statt bulk_create/bulk_update: nur save() schreibt Changelog,
+            # loest Job-Hooks aus (z.B. SyncSocketVlanToSwitch fuer untagged_vlan), prueft per
+            # full_clean und setzt last_updated. Kostet eine Query pro neuem/geaendertem Objekt -
+            # das sind beim Import meist nur wenige, die Lookups oben bleiben eine Query.
+            for vlan in new_vlans:
+                vlan.validated_save()
+                existing_vlans[vlan.vid] = vlan  # hat jetzt eine PK -> fuer die Ports unten
+            for vlan in changed_vlans:
+                vlan.validated_save()
+            created, updated = len(new_vlans), len(changed_vlans)
+            self.logger.info("VLANs parsed: %s; created: %s, updated: %s", len(vlan_map), created, updated)
+
+            # ---------- Interfaces: Access + untagged VLAN mappen, eine Query fuer alle Ports
+            existing_ifaces = {
+                i.name: i for i in Interface.objects.filter(device=device, name__in=list(port_map))
+            }
+            has_mode = hasattr(Interface, "mode")
+
+            new_ifaces, changed_ifaces = [], []
+            for ifname, vname in port_map.items():
+                vid = vlan_map.get(vname)
+                vlan_obj = existing_vlans.get(vid) if vid else None
+
+                iface = existing_ifaces.get(ifname)
+                if not iface:
+                    iface = Interface(
+                        device=device,
+                        name=ifname,
+                        type="other",
+                        status_id=interface_status_id,
+                        enabled=True,
+                    )
+                    if has_mode:
+                        iface.mode = "access"
+                    if vlan_obj:
+                        iface.untagged_vlan = vlan_obj
+                    new_ifaces.append(iface)
+                    continue
+
+                changed = False
+                if has_mode and iface.mode != "access":
+                    iface.mode = "access"; changed = True
+                if vlan_obj and getattr(iface, "untagged_vlan_id", None) != vlan_obj.id:
+                    iface.untagged_vlan = vlan_obj; changed = True
+                if changed:
+                    changed_ifaces.append(iface)
+
+            # wie bei den VLANs: einzeln speichern (Changelog, Job-Hooks, Validierung)
+            for iface in new_ifaces + changed_ifaces:
+                iface.validated_save()
+            port_updates = len(new_ifaces) + len(changed_ifaces)
+
+        self.logger.info("Ports updated: %s", port_updates)
         self.logger.success("Import fertig.")
 
 jobs.register_jobs(ImportJunosFromBackup)
@@ -12,18 +12,97 @@
 # This is the "desired state" - what the device configuration SHOULD look like
 # based on what's in Nautobot. We can later compare this to the actual device config
 # to detect drift, or use it to generate commands to push to the device.
+#
+# BulkBuildIntendedConfig does the same for many devices in parallel threads
+# and commits all files in one git commit at the end.
 
+import hashlib
+import itertools
+import logging
 import os
-import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-from jinja2 import Environment, FileSystemLoader
-from nautobot.apps.jobs import Job, ObjectVar, register_jobs
+from django.db import connection
+from nautobot.apps.jobs import Job, MultiObjectVar, ObjectVar, register_jobs
 from nautobot.dcim.models import Device
 
+from ._git import (
+    commit_paths,
+    defer_commit as git_defer_commit,
+    flush_pending,
+    head_matches,
+    new_batch,
+    repo_dir,
+    repo_info,
+)
+from ._task_log import task_logger
+from ._templates import get_template, template_exists
+
 # Groups all related jobs together in the Nautobot UI
 name = "00_Vlan-Change-Jobs"
 
+# device pk -> (blake2b of the rendered config, (mtime_ns, size) of the file), for
+# configs we have seen unchanged on disk AND in HEAD. If the next render has the
+# same hash and the file wasn't touched since, one stat() replaces reading it.
+# Least recently used entries are dropped beyond RENDER_CACHE_SIZE devices.
+RENDER_CACHE_SIZE = 4096
+_RENDER_CACHE = OrderedDict()
+_RENDER_CACHE_LOCK = threading.Lock()
+
+
+def _file_state(path):
+    """(mtime_ns, size) of a file, or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _file_digest(path):
+    """blake2b (16 bytes) of a file's content, read in blocks; None if it's gone."""
+    hasher = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(65536), b""):
+                hasher.update(block)
+    except FileNotFoundError:
+        return None
+    return hasher.digest()
+
+
+def _discard(path):
+    """Remove a leftover temporary file, if it is there."""
+    if path is None:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _cached_unchanged(device_pk, digest, file_state):
+    """True if we already saw exactly this config, in exactly this file, unchanged."""
+    with _RENDER_CACHE_LOCK:
+        entry = _RENDER_CACHE.get(device_pk)
+        if entry is None or file_state is None or entry != (digest, file_state):
+            return False
+        _RENDER_CACHE.move_to_end(device_pk)
+        return True
+
+
+def _remember_unchanged(device_pk, digest, file_state):
+    """Record a config that is verified unchanged on disk and in HEAD."""
+    with _RENDER_CACHE_LOCK:
+        _RENDER_CACHE[device_pk] = (digest, file_state)
+        _RENDER_CACHE.move_to_end(device_pk)
+        while len(_RENDER_CACHE) > RENDER_CACHE_SIZE:
+            _RENDER_CACHE.popitem(last=False)
+
 
 class BuildIntendedConfig(Job):
     """
@@ -56,188 +135,376 @@ class BuildIntendedConfig(Job):
     DEFAULT_REPO_PATH = "/opt/nautobot/git/poc_netops"  # Fallback if env var not set
     TEMPLATE_REL_PATH = "templates/juniper_junos.j2"  # Path to Jinja template in repo
     INTENDED_DIR_NAME = "intended"  # Subdirectory for intended configs
+    ALLOW_EMPTY_COMMIT = False  # Write + commit even when the rendered config is unchanged (audit trail of runs)
 
-    def run(self, device, interface=None, vlan=None, **kwargs):
-        """
-        Main execution method for building intended config.
-        
-        Args:
-            device: The Device object to build config for (required)
-            interface: Specific interface context (passed through from pipeline, used in logging)
-            vlan: Specific VLAN context (passed through from pipeline, used in logging)
-            **kwargs: Additional arguments (ignored)
-        """
-        
-        self.logger.info(
-            f"[BuildIntendedConfig] Starting intended config build for device {device.name} "
-            f"(database ID: {device.pk})."
+    @classmethod
+    def _repo_root(cls):
+        """Repository location for this job, resolved once per process (see _git.repo_info)."""
+        return repo_info(cls.REPO_ENV_VAR, cls.DEFAULT_REPO_PATH)
+
+    def run(self, device, interface=None, vlan=None, defer_commit=False, **kwargs):
+        """Build the intended config (see do_intended - the pipeline calls that directly)."""
+        do_intended(self.logger, device, interface=interface, vlan=vlan, defer_commit=defer_commit)
+
+
+def do_intended(logger, device, interface=None, vlan=None, defer_commit=False):
+    """
+    Render and save the intended config of one device (the body of BuildIntendedConfig.run).
+
+    Args:
+        logger: Logger to write to (the calling job's self.logger)
+        device: The Device object to build config for (required)
+        interface: Specific interface context (passed through from pipeline, used in logging)
+        vlan: Specific VLAN context (passed through from pipeline, used in logging)
+        defer_commit: False, or a batch from _git.new_batch(): then only write the
+                      file, register it in that batch and leave the git commit to
+                      the caller (see _git.flush_pending). Used by ConfigPipeline.
+    """
+
+    # %-style arguments: the message is only formatted if INFO is actually logged
+    logger.info(
+        "[BuildIntendedConfig] Starting intended config build for device %s (database ID: %s).",
+        device.name,
+        device.pk,
+    )
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "[BuildIntendedConfig] Pipeline context: interface=%s, vlan=%s",
+            interface,
+            getattr(vlan, "id", vlan) if vlan else None,
         )
-        self.logger.info(
-            f"[BuildIntendedConfig] Pipeline context: interface={interface}, "
-            f"vlan={getattr(vlan, 'id', vlan) if vlan else 'None'}"
+
+    # --- Step 1: Locate the Git repository ---
+    # First check environment variable, then fall back to default path
+    # (resolved once per worker process, not on every run)
+    repo = BuildIntendedConfig._repo_root()
+    repo_root = repo.root
+    logger.info("[BuildIntendedConfig] Using Git repository at: %s", repo_root)
+
+    # Validate that the repository exists
+    if not repo.exists:
+        logger.error(
+            "[BuildIntendedConfig] Git repository path %s does not exist. "
+            "Please create the directory or set %s environment variable. "
+            "Example: mkdir -p %s",
+            repo_root,
+            BuildIntendedConfig.REPO_ENV_VAR,
+            repo_root,
         )
+        return
 
-        # --- Step 1: Locate the Git repository ---
-        # First check environment variable, then fall back to default path
-        repo_root = os.environ.get(self.REPO_ENV_VAR, self.DEFAULT_REPO_PATH)
-        repo_root = Path(repo_root)  # Convert to Path object for easier file operations
-        self.logger.info(f"[BuildIntendedConfig] Using Git repository at: {repo_root}")
-
-        # Validate that the repository exists
-        if not repo_root.exists():
-            self.logger.error(
-                f"[BuildIntendedConfig] Git repository path {repo_root} does not exist. "
-                f"Please create the directory or set {self.REPO_ENV_VAR} environment variable. "
-                f"Example: mkdir -p {repo_root}"
-            )
-            return
+    # --- Step 2: Locate the Jinja2 template ---
+    template_path = repo_root / BuildIntendedConfig.TEMPLATE_REL_PATH
 
-        # --- Step 2: Locate the Jinja2 template ---
-        template_path = repo_root / self.TEMPLATE_REL_PATH
-        
-        if not template_path.exists():
-            self.logger.error(
-                f"[BuildIntendedConfig] Template file not found at {template_path}. "
-                f"Please ensure the Jinja2 template exists at this location. "
-                f"Expected path: {self.TEMPLATE_REL_PATH}"
-            )
-            return
+    # A file (not a directory of that name), stat()ed at most every 30s (see _templates.py)
+    if not template_exists(template_path):
+        logger.error(
+            "[BuildIntendedConfig] Template file not found at %s. "
+            "Please ensure the Jinja2 template exists at this location. "
+            "Expected path: %s",
+            template_path,
+            BuildIntendedConfig.TEMPLATE_REL_PATH,
+        )
+        return
 
-        # --- Step 3: Get interface data from Nautobot ---
-        # Query all interfaces for this device
-        # This is our source of truth - what Nautobot says the device should have
-        interfaces = list(device.interfaces.all())
-        self.logger.info(
-            f"[BuildIntendedConfig] Retrieved {len(interfaces)} interfaces from Nautobot "
-            f"for device {device.name}. These will be used to render the intended config."
+    # --- Step 3: Get interface data from Nautobot ---
+    # Query all interfaces for this device
+    # This is our source of truth - what Nautobot says the device should have
+    # The template uses i.name and i.untagged_vlan.id/.name only. select_related
+    # fetches the VLAN in the same query (otherwise: one extra query per interface
+    # while rendering), only() skips all columns the template never looks at.
+    # If you use more fields in the template, add them here.
+    # Deliberately not cached between runs: the pipeline runs *because* an
+    # interface's VLAN changed, and that doesn't touch device.last_updated - a
+    # cache keyed on the device would render the old VLAN. One query per run it is.
+    interfaces = list(
+        device.interfaces.select_related("untagged_vlan").only(
+            "name", "untagged_vlan", "untagged_vlan__name"
         )
+    )
+    logger.info(
+        "[BuildIntendedConfig] Retrieved %s interfaces from Nautobot "
+        "for device %s. These will be used to render the intended config.",
+        len(interfaces),
+        device.name,
+    )
 
-        # --- Step 4: Render the Jinja2 template ---
-        # The template will generate the configuration based on interface data
-        try:
-            # Set up Jinja2 environment
-            # FileSystemLoader tells Jinja where to find templates
-            env = Environment(
-                loader=FileSystemLoader(str(template_path.parent)),
-                autoescape=False,  # Don't escape characters (we're generating config, not HTML)
-            )
-            
-            # Load the specific template file
-            template = env.get_template(template_path.name)
-            
-            # Render the template with our interface data
-            # The template can loop over 'interfaces' and generate config for each one
-            rendered = template.render(
-                interfaces=interfaces,
-                device=device,  # Also pass device in case template needs it
-            )
-            
-            self.logger.info(
-                f"[BuildIntendedConfig] Successfully rendered template. "
-                f"Generated config is {len(rendered)} characters long."
-            )
-            
-        except Exception as e:
-            # Template rendering failed - could be syntax error in template or missing data
-            self.logger.error(
-                f"[BuildIntendedConfig] Failed to render template {template_path}. "
-                f"Error: {e}. Please check the template syntax and ensure all required "
-                f"variables are available."
-            )
-            return
+    # --- Step 4 + 5: Render the Jinja2 template straight into a file ---
+    # Create the intended directory if it doesn't exist
+    # (repo_info already listed the repository, so usually there's nothing to do)
+    intended_dir = repo_dir(repo, BuildIntendedConfig.INTENDED_DIR_NAME)
 
-        # Validate that we got some actual config output
-        if not rendered or len(rendered) < 10:
-            self.logger.warning(
-                f"[BuildIntendedConfig] Rendered config seems empty or very short "
-                f"({len(rendered)} characters). This might indicate a problem with the template. "
-                f"Continuing anyway..."
-            )
+    # Create filename based on device name
+    # Format: <device_name>.conf
+    intended_file = intended_dir / f"{device.name}.conf"
 
-        # --- Step 5: Write the intended config to a file ---
-        # Create the intended directory if it doesn't exist
-        intended_dir = repo_root / self.INTENDED_DIR_NAME
-        intended_dir.mkdir(parents=True, exist_ok=True)
+    # We render into a temporary file next to the real one and rename it over the
+    # old one at the end (atomic: readers and git see either the old or the new
+    # file, never half of one). The template output is streamed into that file
+    # piece by piece - the whole config never sits in memory as one string plus
+    # its encoded copy - and hashed on the way for the "unchanged" check below.
+    # The temporary file gets a unique name, so two runs for the same device
+    # (e.g. a pipeline and a bulk run) never write into each other's file.
+    tmp_file = None
+    try:
+        # Load the template through the shared Jinja2 environment (see _templates.py)
+        # It is only read and compiled on the first run, later runs reuse it
+        template = get_template(template_path)
 
-        # Create filename based on device name
-        # Format: <device_name>.conf
-        intended_file = intended_dir / f"{device.name}.conf"
-        
-        try:
-            # Write the rendered configuration to the file
+        # Render the template with our interface data
+        # The template can loop over 'interfaces' and generate config for each one
+        stream = template.stream(
+            interfaces=interfaces,
+            device=device,  # Also pass device in case template needs it
+        )
+        stream.enable_buffering(size=64)  # Hand out 64 pieces at a time, not every tiny one
+
+        hasher = hashlib.blake2b(digest_size=16)
+        size = 0
+        with tempfile.NamedTemporaryFile(
+            dir=intended_dir, prefix=f"{device.name}.", suffix=".tmp", delete=False
+        ) as fh:
+            tmp_file = Path(fh.name)
+            # NamedTemporaryFile creates the file as 0600 - keep the old 0644 after the rename
+            os.fchmod(fh.fileno(), 0o644)
             # Add a newline at the end for consistent formatting
-            intended_file.write_text(rendered + "\n", encoding="utf-8")
-            self.logger.info(
-                f"[BuildIntendedConfig] Successfully wrote intended configuration to {intended_file}."
-            )
-        except Exception as e:
-            self.logger.error(
-                f"[BuildIntendedConfig] Failed to write intended config file {intended_file}: {e}"
-            )
-            return
+            for chunk in itertools.chain(stream, ("\n",)):
+                chunk = chunk.encode("utf-8")
+                fh.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+        digest = hasher.digest()
 
-        # --- Step 6: Commit to Git ---
-        # Check if this is actually a Git repository
-        git_dir = repo_root / ".git"
-        if not git_dir.exists():
-            self.logger.warning(
-                f"[BuildIntendedConfig] Directory {repo_root} is not a Git repository "
-                f"(no .git directory found). Skipping git operations. "
-                f"To initialize git: cd {repo_root} && git init"
-            )
-            return
+        logger.info(
+            "[BuildIntendedConfig] Successfully rendered template. "
+            "Generated config is %s bytes long.",
+            size,
+        )
 
-        # Get relative path for git commands
-        # Git works better with paths relative to the repo root
-        rel_intended_path = intended_file.relative_to(repo_root)
+    except Exception as e:
+        # Template rendering failed - could be syntax error in template or missing data
+        _discard(tmp_file)
+        logger.error(
+            "[BuildIntendedConfig] Failed to render template %s. "
+            "Error: %s. Please check the template syntax and ensure all required "
+            "variables are available.",
+            template_path,
+            e,
+        )
+        return
 
-        try:
-            # Stage the intended config file
-            self.logger.info(
-                f"[BuildIntendedConfig] Running 'git add {rel_intended_path}' to stage file."
-            )
-            add_proc = subprocess.run(
-                ["git", "-C", str(repo_root), "add", str(rel_intended_path)],
-                capture_output=True,  # Capture output for logging
-                text=True,  # Get strings instead of bytes
-                check=False,  # Don't raise exception on error
-            )
-            # Log the result
-            self.logger.info(
-                f"[BuildIntendedConfig] git add completed with exit code {add_proc.returncode}. "
-                f"Output: '{add_proc.stdout.strip()}' | Errors: '{add_proc.stderr.strip()}'"
-            )
+    # Validate that we got some actual config output
+    if size < 11:  # 10 characters + our newline
+        logger.warning(
+            "[BuildIntendedConfig] Rendered config seems empty or very short "
+            "(%s bytes). This might indicate a problem with the template. "
+            "Continuing anyway...",
+            size,
+        )
 
-            # Commit the staged changes
-            commit_msg = f"Update intended config for device {device.name}"
-            self.logger.info(
-                f"[BuildIntendedConfig] Running 'git commit -m \"{commit_msg}\"'."
+    # --- Skip unchanged configs ---
+    # Most pipeline runs change one port, or nothing at all. If the rendered config is
+    # byte-for-byte what is already on disk, replacing the file and running git again
+    # only produces churn.
+    # We also ask git whether HEAD has the same content: if an earlier commit failed,
+    # the file is up to date on disk but still needs to be committed.
+    write_needed = True
+    if not BuildIntendedConfig.ALLOW_EMPTY_COMMIT:
+        # Seen this exact config before, and nobody touched the file since?
+        # Then we don't even need to read it (or ask git).
+        file_state = _file_state(intended_file)
+        if _cached_unchanged(device.pk, digest, file_state):
+            _discard(tmp_file)
+            logger.info(
+                "[BuildIntendedConfig] Intended config of %s is unchanged. "
+                "Skipping write and git commit.",
+                device.name,
             )
-            commit_proc = subprocess.run(
-                ["git", "-C", str(repo_root), "commit", "--allow-empty", "-m", commit_msg],
-                capture_output=True,
-                text=True,
-                check=False,
+            return
+
+        # Different size = different content, no need to read anything
+        unchanged = (
+            file_state is not None
+            and file_state[1] == size
+            and _file_digest(intended_file) == digest
+        )
+        if unchanged:
+            # None = git couldn't tell us, then the file on disk has to do
+            committed = (
+                head_matches(repo_root, intended_file.relative_to(repo_root), tmp_file.read_bytes())
+                if repo.is_git
+                else None
             )
-            # Log the result
-            self.logger.info(
-                f"[BuildIntendedConfig] git commit completed with exit code {commit_proc.returncode}. "
-                f"Output: '{commit_proc.stdout.strip()}' | Errors: '{commit_proc.stderr.strip()}'"
+            _discard(tmp_file)
+            if committed is not False:
+                if committed:
+                    # Verified on disk and in HEAD - next time a stat() is enough
+                    _remember_unchanged(device.pk, digest, file_state)
+                logger.info(
+                    "[BuildIntendedConfig] Intended config of %s is unchanged. "
+                    "Skipping write and git commit.",
+                    device.name,
+                )
+                return
+            logger.info(
+                "[BuildIntendedConfig] Intended config of %s is up to date on disk "
+                "but not committed yet. Skipping the write, committing it.",
+                device.name,
             )
-            
-            # Note: We use --allow-empty to create commits even if nothing changed
-            # This gives us an audit trail of when the job ran, even if config was identical
+            write_needed = False
 
-        except Exception as e:
-            self.logger.error(
-                f"[BuildIntendedConfig] Error during git operations in {repo_root}: {e}"
-            )
+    try:
+        # Put the rendered configuration in place (the atomic rename, see above)
+        if write_needed:
+            os.replace(tmp_file, intended_file)
+        logger.info(
+            "[BuildIntendedConfig] Successfully wrote intended configuration to %s.",
+            intended_file,
+        )
+    except Exception as e:
+        _discard(tmp_file)
+        logger.error(
+            "[BuildIntendedConfig] Failed to write intended config file %s: %s",
+            intended_file,
+            e,
+        )
+        return
+
+    # --- Step 6: Commit to Git ---
+    # Check if this is actually a Git repository
+    if not repo.is_git:
+        logger.warning(
+            "[BuildIntendedConfig] Directory %s is not a Git repository "
+            "(no .git directory found). Skipping git operations. "
+            "To initialize git: cd %s && git init",
+            repo_root,
+            repo_root,
+        )
+        return
+
+    # Get relative path for git commands
+    # Git works better with paths relative to the repo root
+    rel_intended_path = intended_file.relative_to(repo_root)
+
+    # Stage and commit the intended config file
+    # (one "git commit --only" process for files git already tracks, see _git.py)
+    # Set ALLOW_EMPTY_COMMIT = True to get a commit even if nothing changed
+    # This gives an audit trail of when the job ran, even if config was identical
+    commit_msg = f"Update intended config for device {device.name}"
+    if defer_commit:
+        # The pipeline commits this file together with the backup in one go
+        git_defer_commit(repo_root, rel_intended_path, commit_msg, batch=defer_commit)
+        logger.info(
+            "[BuildIntendedConfig] Wrote %s, commit deferred to the pipeline.",
+            rel_intended_path,
+        )
+        return
+
+    commit_paths(
+        repo_root,
+        [rel_intended_path],
+        commit_msg,
+        logger,
+        "[BuildIntendedConfig]",
+        allow_empty=BuildIntendedConfig.ALLOW_EMPTY_COMMIT,
+    )
+
+    logger.info(
+        "[BuildIntendedConfig] Finished building intended config for device %s. "
+        "File saved to %s and committed to Git.",
+        device.name,
+        intended_file,
+    )
+
+
+class BulkBuildIntendedConfig(Job):
+    """
+    Builds the intended configuration for many devices at once.
+
+    Each device is rendered and written by do_intended as usual, but in parallel
+    threads (the work is mostly waiting on the database and the disk), and the
+    files of all devices go into a single git commit at the end.
+    """
+
+    class Meta:
+        name = "02_Bulk build intended config (POC)"
+        description = "Render and store the intended configuration of several devices in parallel."
+        commit_default = False
+
+    devices = MultiObjectVar(
+        model=Device,
+        required=True,
+        description="Devices to build intended configuration for.",
+    )
+
+    # How many devices we render at the same time
+    MAX_WORKERS = 8
+
+    def run(self, devices, **kwargs):
+        """Build all selected devices (see do_intended_many)."""
+        do_intended_many(self.logger, devices, max_workers=self.MAX_WORKERS)
+
+
+def do_intended_many(logger, devices, max_workers=BulkBuildIntendedConfig.MAX_WORKERS):
+    """
+    Run do_intended for several devices in parallel, then commit all files at once.
+
+    Args:
+        logger: Logger to write to (the calling job's self.logger)
+        devices: The Device objects to build config for
+        max_workers: Upper limit of parallel threads
+
+    Returns:
+        Names of the devices that failed
+    """
+    devices = list(devices)
+    if not devices:
+        return []
+    # The workers log from pool threads - bind the job's task id here, on the
+    # job's thread, or their lines never reach the JobResult (see _task_log.py)
+    logger = task_logger(logger)
+    workers = max(1, min(max_workers, len(devices)))
+    logger.info(
+        "[BuildIntendedConfig] Building intended config for %s device(s) "
+        "with %s parallel worker(s).",
+        len(devices),
+        workers,
+    )
+
+    # All devices' files go into this batch and are committed together below
+    batch = new_batch()
+
+    def _build_one(device):
+        try:
+            do_intended(logger, device, defer_commit=batch)
+        finally:
+            # Django gives every thread its own DB connection - close ours when done
+            # (close_old_connections() would keep it open for CONN_MAX_AGE)
+            connection.close()
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-intended") as executor:
+        futures = {executor.submit(_build_one, device): device for device in devices}
+        for future in as_completed(futures):
+            device = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(device.name)
+                logger.error("[BuildIntendedConfig] Intended config for %s failed: %s", device.name, e)
 
-        self.logger.info(
-            f"[BuildIntendedConfig] Finished building intended config for device {device.name}. "
-            f"File saved to {intended_file} and committed to Git."
+    # One git commit for all devices instead of one per device
+    repo = BuildIntendedConfig._repo_root()
+    if repo.is_git:
+        flush_pending(
+            repo.root,
+            logger,
+            "[BuildIntendedConfig]",
+            batch=batch,
+            message=f"Update intended config (bulk build of {len(devices)} device(s))",
         )
+    return failed
 
 
-# Register this job so Nautobot can discover and run it
-register_jobs(BuildIntendedConfig)
+# Register these jobs so Nautobot can discover and run them
+register_jobs(BuildIntendedConfig, BulkBuildIntendedConfig)
@@ -3,30 +3,80 @@
 # This job pushes configuration changes to a network device.
 #
 # What it does:
-# 1. Takes a device and specific interface from the pipeline
-# 2. Renders Jinja2 template with JUST that interface to get the config commands
-# 3. Connects to the device via SSH (using Netmiko)
-# 4. First deletes any existing VLAN configuration on the interface
-# 5. Then pushes the new "set" commands from the template
+# 1. Takes a device and specific interface from the pipeline (or several interfaces
+#    of that device at once)
+# 2. Renders the template's push_interface macro with JUST those interfaces to get the config commands
+# 3. Connects to the device via SSH (using Netmiko, through the shared connection pool -
+#    or NETCONF with PUSH_TRANSPORT=netconf, see _junos_netconf.py; the bulk job
+#    can push all devices on one event loop with PUSH_TRANSPORT=scrapli, see _scrapli_async.py)
+# 4. Per interface, first deletes any existing VLAN configuration, then sets the
+#    new one (both lines come from the template) - all in one send_config_set
+# 5. Commits them as one transaction ("configure private" + commit)
 #
 # Why we need this:
 # After updating Nautobot (source of truth) and building the intended config,
 # we need to actually apply those changes to the physical/virtual device.
 # This job makes that happen by sending the config commands via SSH.
 
+import logging
 import os
-from pathlib import Path
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from jinja2 import Environment, FileSystemLoader
-from nautobot.apps.jobs import Job, ObjectVar, register_jobs
+from django.db import connection
+from nautobot.apps.jobs import Job, MultiObjectVar, ObjectVar, register_jobs
 from nautobot.dcim.models import Device, Interface
 
-from nautobot.extras.choices import SecretsGroupAccessTypeChoices, SecretsGroupSecretTypeChoices
-from nautobot.extras.secrets.exceptions import SecretError
+from . import _device_state
+from ._device_info import device_info
+from ._git import repo_info
+from ._junos_netconf import netconf_enabled, push_set_commands
+from ._netmiko_pool import POOL, ConnectHandler, _env_int, file_transfer
+from ._scrapli_async import scrapli_enabled, send_many
+from ._task_log import task_logger
+from ._templates import get_template, template_exists, warm_up
+from .backup_config_job import build_device_params
 
 # Groups all related jobs together in the Nautobot UI
 name = "00_Vlan-Change-Jobs"
 
+# Words in the device output that mean a command or the commit failed
+# (one case-insensitive scan instead of lower()-ing the output for every word)
+_DEVICE_ERROR_RE = re.compile(r"error|invalid|unknown command", re.IGNORECASE)
+
+# "0" = build the push commands with JunosSetEmitter instead of rendering the template.
+# Faster, but edits to the template's render_interface macro are then ignored by
+# the push (the intended config is always rendered from the template).
+_USE_JINJA = os.environ.get("POC_NETOPS_USE_JINJA", "1") != "0"
+
+
+class JunosSetEmitter:
+    """The commands of templates/juniper_junos.j2's render_interface and push_interface, as plain Python."""
+
+    @staticmethod
+    def delete_line(interface):
+        """The command that removes the port's current VLAN (first line of push_interface)."""
+        return f"delete interfaces {interface.name} unit 0 family ethernet-switching vlan members"
+
+    @classmethod
+    def emit(cls, interface):
+        """Commands for one interface (empty if it has no untagged VLAN, like the template)."""
+        vlan = interface.untagged_vlan
+        if vlan is None:
+            return []
+        prefix = f"set interfaces {interface.name} unit 0 family ethernet-switching"
+        return [
+            f"{prefix} interface-mode access",
+            f"{prefix} vlan members {vlan.name}",
+        ]
+
+    @classmethod
+    def emit_push(cls, interface):
+        """Commands to push for one interface: the delete, then its "set" commands."""
+        return [cls.delete_line(interface), *cls.emit(interface)]
+
 
 class PushConfigToDevice(Job):
     """
@@ -57,283 +107,643 @@ class PushConfigToDevice(Job):
     REPO_ENV_VAR = "POC_NETOPS_REPO"  # Where to find the Git repo
     DEFAULT_REPO_PATH = "/opt/nautobot/git/poc_netops"
     TEMPLATE_REL_PATH = "templates/juniper_junos.j2"  # Jinja template for generating config
-
-    def run(self, device, interface=None, vlan=None, **kwargs):
-        """
-        Main execution method for pushing config to device.
-        
-        Args:
-            device: The Device object to push config to (required)
-            interface: The specific Interface to configure (passed from pipeline)
-            vlan: The VLAN to configure (optional, we'll get it from interface if not provided)
-            **kwargs: Additional arguments (ignored)
-        """
-        
-        self.logger.info(
-            "[PushConfigToDevice] Starting config push process for device "
-            f"{device.name} (database ID: {device.pk})."
+    # send_config_set: don't wait for each command's echo before sending the next
+    # (Junos prompts are predictable; errors still show up in the output we check)
+    CMD_VERIFY = False
+    READ_TIMEOUT = 30  # Max seconds to wait for the device after the last command
+    # Private candidate: our commands are committed on their own, as one transaction
+    CONFIG_MODE_COMMAND = "configure private"
+    # Batches with more commands than this are copied to the device as a file (SCP)
+    # and applied with ONE "load set" instead of being typed line by line.
+    # SCP logs in a second time, so it only pays off for big batches. 0 = never.
+    # (an invalid value falls back to 0 instead of breaking the import of all jobs)
+    FILE_PUSH_MIN_LINES = _env_int("PUSH_FILE_MIN_LINES", 0)
+    FILE_PUSH_DIR = "/var/tmp"  # Where the file goes on the device
+
+    @classmethod
+    def _repo_root(cls):
+        """Repository location for this job, resolved once per process (see _git.repo_info)."""
+        return repo_info(cls.REPO_ENV_VAR, cls.DEFAULT_REPO_PATH)
+
+    def run(self, device, interface=None, vlan=None, conn=None, interfaces=None, **kwargs):
+        """Push the config (see do_push - the pipeline calls that directly)."""
+        do_push(self.logger, device, interface=interface, vlan=vlan, conn=conn, interfaces=interfaces)
+
+
+def _check_interface(logger, device, interface):
+    """True if interface is an Interface of device (logs why not otherwise)."""
+    # Make sure the interface parameter is actually an Interface object
+    if not isinstance(interface, Interface):
+        logger.error(
+            "[PushConfigToDevice] The 'interface' parameter is not an Interface object "
+            "(got %s). Cannot proceed. "
+            "This indicates a bug in the calling code.",
+            type(interface).__name__,
         )
+        return False
+
+    # Verify that this interface actually belongs to the device we're configuring
+    # This prevents accidentally configuring the wrong device
+    if interface.device_id != device.pk:
+        logger.error(
+            "[PushConfigToDevice] Interface %s does not belong to "
+            "device %s (it belongs to %s). "
+            "Cannot push config. This indicates a logic error in the pipeline.",
+            interface.name,
+            device.name,
+            interface.device.name,
+        )
+        return False
+    return True
 
-        # Import Netmiko lazily (only when we need it)
-        # This prevents import errors if netmiko isn't installed
-        try:
-            from netmiko import ConnectHandler
-        except ModuleNotFoundError:
-            self.logger.error(
-                "[PushConfigToDevice] The 'netmiko' library is not installed. "
-                "Cannot push configuration to device. Please install it: pip install netmiko"
-            )
+
+def do_push(logger, device, interface=None, vlan=None, conn=None, interfaces=None):
+    """
+    Render the config and push it to one device (the body of PushConfigToDevice.run).
+
+    Args:
+        logger: Logger to write to (the calling job's self.logger)
+        device: The Device object to push config to (required)
+        interface: The specific Interface to configure (passed from pipeline)
+        vlan: The VLAN to configure (optional, we'll get it from interface if not provided)
+        conn: Already-open Netmiko session from the pipeline (optional).
+              If given, we use it instead of opening our own SSH connection.
+        interfaces: Several Interfaces of the device to configure at once (optional).
+                    All of them go out in ONE send_config_set call - one trip into
+                    configuration mode (and one commit on the device) instead of one
+                    per port. Each uses its own untagged VLAN.
+    """
+
+    logger.info(
+        "[PushConfigToDevice] Starting config push process for device "
+        "%s (database ID: %s).",
+        device.name,
+        device.pk,
+    )
+
+    # Netmiko is imported once when _netmiko_pool is loaded - here we only check
+    # whether that worked
+    if ConnectHandler is None:
+        logger.error(
+            "[PushConfigToDevice] The 'netmiko' library is not installed. "
+            "Cannot push configuration to device. Please install it: pip install netmiko"
+        )
+        return
+
+    prepared = prepare_push(logger, device, interface=interface, vlan=vlan, interfaces=interfaces)
+    if prepared is None:
+        return
+    config_lines, iface_names, driver, targets = prepared
+
+    # NETCONF sends the whole batch as one RPC (if enabled and PyEZ is installed).
+    # It has its own session, so a Netmiko session from the pipeline isn't used then.
+    use_netconf = netconf_enabled()
+
+    # --- Resolve connection parameters ---
+    # Skip the IP/credential lookup entirely when the pipeline already
+    # opened a session for us
+    if conn is None or use_netconf:
+        device_params = build_device_params(device, driver, logger, "[PushConfigToDevice]")
+        if device_params is None:
             return
-        except Exception as e:
-            self.logger.error(
-                f"[PushConfigToDevice] Unexpected error importing netmiko: {e}"
+        host = device_params["host"]
+    else:
+        host = conn.host
+
+    # --- Connect and push configuration ---
+    try:
+        if use_netconf:
+            logger.info(
+                "[PushConfigToDevice] Connecting to device %s at %s via NETCONF. "
+                "Loading and committing %s configuration commands for interface(s) %s...",
+                device.name,
+                host,
+                len(config_lines),
+                iface_names,
             )
-            return
+            # One load-configuration RPC + commit; the diff is what we log below
+            output = push_set_commands(
+                device_params,
+                config_lines,
+                comment=f"Nautobot VLAN push: {iface_names}",
+            )
+        elif conn is not None:
+            # Reuse the session opened by the pipeline (the pipeline closes it)
+            logger.info(
+                "[PushConfigToDevice] Reusing pipeline SSH session to %s. Sending "
+                "%s configuration commands for interface(s) %s...",
+                host,
+                len(config_lines),
+                iface_names,
+            )
+            output = _send_and_commit(logger, conn, config_lines, iface_names)
+        else:
+            logger.info(
+                "[PushConfigToDevice] Connecting to device %s at %s via SSH "
+                "to push configuration for interface(s) %s...",
+                device.name,
+                host,
+                iface_names,
+            )
+            # Borrow a connection from the process-wide pool (like the backup job):
+            # pushes to the same device in a row skip the SSH handshake.
+            # The context manager hands it back (or closes it if something failed).
+            with POOL.acquire(device_params) as new_conn:
+                logger.info(
+                    "[PushConfigToDevice] Successfully connected. Sending %s "
+                    "configuration commands...",
+                    len(config_lines),
+                )
 
-        self.logger.info(
-            f"[PushConfigToDevice] Pipeline context: interface={interface}, "
-            f"vlan={getattr(vlan, 'id', vlan) if vlan else 'None'}"
+                # Send all commands to the device and commit them in one transaction
+                output = _send_and_commit(logger, new_conn, config_lines, iface_names)
+
+    except Exception as e:
+        # Connection or command execution failed
+        logger.error(
+            "[PushConfigToDevice] Failed to push configuration to device "
+            "%s (%s). Error: %s",
+            device.name,
+            host,
+            e,
         )
+        # We don't know what made it to the device - push everything next time
+        _device_state.forget(device.pk)
+        return
 
-        # --- Validation: Make sure we have an interface to configure ---
-        if interface is None:
-            self.logger.warning(
-                "[PushConfigToDevice] No interface specified in pipeline context. "
-                "Cannot push config without knowing which interface to configure. "
-                "This job should be called from the pipeline with interface parameter."
-            )
-            return
+    if _report_output(logger, device, iface_names, output):
+        _remember_pushed(device, targets)
 
-        # Make sure the interface parameter is actually an Interface object
-        if not isinstance(interface, Interface):
-            self.logger.error(
-                f"[PushConfigToDevice] The 'interface' parameter is not an Interface object "
-                f"(got {type(interface).__name__}). Cannot proceed. "
-                f"This indicates a bug in the calling code."
-            )
-            return
 
-        # Verify that this interface actually belongs to the device we're configuring
-        # This prevents accidentally configuring the wrong device
-        if interface.device != device:
-            self.logger.error(
-                f"[PushConfigToDevice] Interface {interface.name} does not belong to "
-                f"device {device.name} (it belongs to {interface.device.name}). "
-                f"Cannot push config. This indicates a logic error in the pipeline."
-            )
-            return
+def _remember_pushed(device, targets):
+    """Record the VLANs just pushed, so an identical push in the next minutes is skipped."""
+    _device_state.remember(
+        device.pk,
+        {iface.name: iface.untagged_vlan.name for iface in targets if iface.untagged_vlan is not None},
+    )
 
-        # Get the VLAN we're supposed to configure
-        # If not passed explicitly, get it from the interface
-        if vlan is None:
-            vlan = getattr(interface, "untagged_vlan", None)
 
-        if vlan is None:
-            # No VLAN to configure - nothing to do
-            self.logger.info(
-                f"[PushConfigToDevice] No VLAN configured on interface {interface.name}. "
-                f"Nothing to push to device."
-            )
-            return
+def _send_and_commit(logger, conn, config_lines, iface_names):
+    """
+    Send config_lines over a Netmiko session and commit them as ONE transaction.
 
-        # --- Render the configuration using Jinja2 template ---
-        # Locate the Git repository
-        repo_root = os.environ.get(self.REPO_ENV_VAR, self.DEFAULT_REPO_PATH)
-        repo_root = Path(repo_root)
-        self.logger.info(f"[PushConfigToDevice] Using Git repository at: {repo_root}")
-
-        # Find the template file
-        template_path = repo_root / self.TEMPLATE_REL_PATH
-        if not template_path.exists():
-            self.logger.error(
-                f"[PushConfigToDevice] Template file not found at {template_path}. "
-                f"Cannot generate configuration commands. Please ensure template exists."
-            )
-            return
+    "configure private" gives us our own candidate configuration: the deletes and
+    sets are committed together (or not at all), and nobody else's uncommitted
+    changes end up in our commit. Returns the combined device output.
+    """
+    if (
+        PushConfigToDevice.FILE_PUSH_MIN_LINES
+        and len(config_lines) > PushConfigToDevice.FILE_PUSH_MIN_LINES
+        and file_transfer is not None
+    ):
+        dest_file = _copy_commands_to_device(logger, conn, config_lines)
+        if dest_file is not None:
+            dest_path = f"{PushConfigToDevice.FILE_PUSH_DIR}/{dest_file}"
+            try:
+                output = conn.config_mode(config_command=PushConfigToDevice.CONFIG_MODE_COMMAND)
+                try:
+                    output += conn.send_command(
+                        f"load set {dest_path}",
+                        read_timeout=PushConfigToDevice.READ_TIMEOUT,
+                    )
+                    output += conn.commit(comment=f"Nautobot VLAN push: {iface_names}")
+                finally:
+                    output += conn.exit_config_mode()
+            finally:
+                # Don't leave our files behind in /var/tmp on the device
+                # (operational mode again here, after exit_config_mode)
+                try:
+                    conn.send_command(f"file delete {dest_path}")
+                except Exception as e:
+                    logger.warning(
+                        "[PushConfigToDevice] Could not delete %s on the device: %s",
+                        dest_path,
+                        e,
+                    )
+            return output
+
+    output = conn.send_config_set(
+        config_lines,
+        config_mode_command=PushConfigToDevice.CONFIG_MODE_COMMAND,
+        exit_config_mode=False,  # The commit below still needs configuration mode
+        cmd_verify=PushConfigToDevice.CMD_VERIFY,
+        read_timeout=PushConfigToDevice.READ_TIMEOUT,
+    )
+    try:
+        output += conn.commit(comment=f"Nautobot VLAN push: {iface_names}")
+    finally:
+        # Always leave configuration mode - the session goes back to the pool
+        # (a failed commit discards the private candidate here)
+        output += conn.exit_config_mode()
+    return output
 
-        try:
-            # Set up Jinja2 to render the template
-            env = Environment(
-                loader=FileSystemLoader(str(template_path.parent)),
-                autoescape=False,  # No HTML escaping needed for network configs
-            )
-            template = env.get_template(template_path.name)
-            
-            # Render template with ONLY this specific interface
-            # This generates the configuration commands for just this one interface
-            rendered = template.render(interfaces=[interface])
-            
-            self.logger.info(
-                f"[PushConfigToDevice] Rendered template for interface {interface.name}. "
-                f"Generated {len(rendered)} characters of configuration."
-            )
-            
-        except Exception as e:
-            self.logger.error(
-                f"[PushConfigToDevice] Failed to render template {template_path}: {e}"
-            )
-            return
 
-        # --- Build the list of commands to send ---
-        # Start with a delete command to remove any existing VLAN config
-        # This ensures a clean slate before applying new config
-        config_lines = [
-            f"delete interfaces {interface.name} unit 0 family ethernet-switching vlan members"
-        ]
+def _copy_commands_to_device(logger, conn, config_lines):
+    """
+    SCP config_lines to FILE_PUSH_DIR on the device. Returns the file name, or None
+    if the copy failed (SCP disabled, no space, ...) - then we type the commands.
+    """
+    dest_file = f"nautobot-push-{os.getpid()}-{threading.get_ident()}.set"
+    with tempfile.NamedTemporaryFile("w", suffix=".set", delete=False) as fh:
+        fh.write("\n".join(config_lines))
+        fh.write("\n")
+    try:
+        file_transfer(
+            conn,
+            source_file=fh.name,
+            dest_file=dest_file,
+            file_system=PushConfigToDevice.FILE_PUSH_DIR,
+            direction="put",
+            overwrite_file=True,
+        )
+    except Exception as e:
+        # Logged every time: a broken SCP costs each big push an extra login
+        logger.warning(
+            "[PushConfigToDevice] Copying the commands to the device via SCP failed, "
+            "sending them line by line instead (PUSH_FILE_MIN_LINES=0 turns the file "
+            "push off): %s",
+            e,
+        )
+        return None
+    finally:
+        os.unlink(fh.name)
+    return dest_file
 
-        # Add all the "set" commands from the rendered template
-        # Each line becomes a separate command
-        for line in rendered.splitlines():
-            line = line.strip()  # Remove leading/trailing whitespace
-            if not line:  # Skip empty lines
-                continue
-            config_lines.append(line)
-
-        # Sanity check - make sure we actually have commands to send
-        if not config_lines:
-            self.logger.warning(
-                f"[PushConfigToDevice] No configuration commands generated for interface "
-                f"{interface.name}. Template might be empty or misconfigured. Nothing to push."
-            )
-            return
 
-        self.logger.info(
-            f"[PushConfigToDevice] Prepared {len(config_lines)} commands to send to "
-            f"device {device.name} for interface {interface.name}:"
+def prepare_push(logger, device, interface=None, vlan=None, interfaces=None):
+    """
+    Validate the interfaces and render the commands for one device (no SSH yet).
+
+    Same arguments as do_push. Used by do_push and by the async bulk push, which
+    sends the commands of many devices itself.
+
+    Returns:
+        (config_lines, iface_names, driver, targets), or None if there is nothing
+        to push (the reason has been logged). targets are the Interfaces pushed.
+    """
+    # Only worth building when INFO is actually logged (bulk runs do this per device)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "[PushConfigToDevice] Pipeline context: interface=%s, interfaces=%s, vlan=%s",
+            interface,
+            interfaces,
+            getattr(vlan, "id", vlan) if vlan else None,
         )
-        # Log each command so we can see exactly what will be sent
-        for i, cmd in enumerate(config_lines, 1):
-            self.logger.info(f"  Command {i}: {cmd}")
 
-        # --- Validate device platform ---
-        # This PoC only supports Juniper JunOS devices
-        platform = getattr(device, "platform", None)
-        driver = getattr(platform, "network_driver", None)
+    # One list for both call styles: the single interface of the pipeline, plus
+    # whatever a batched caller passed (duplicates are only pushed once)
+    candidates = list(interfaces or [])
+    if interface is not None and interface not in candidates:
+        candidates.insert(0, interface)
+
+    # --- Validation: Make sure we have an interface to configure ---
+    if not candidates:
+        logger.warning(
+            "[PushConfigToDevice] No interface specified in pipeline context. "
+            "Cannot push config without knowing which interface to configure. "
+            "This job should be called from the pipeline with interface parameter."
+        )
+        return
 
-        if driver != "juniper_junos":
-            self.logger.info(
-                f"[PushConfigToDevice] Device {device.name} has network driver '{driver}', "
-                f"not 'juniper_junos'. This PoC only supports Juniper devices. Skipping push."
-            )
+    # Keep the interfaces that belong to this device and have a VLAN to configure
+    targets = []
+    for iface in candidates:
+        if not _check_interface(logger, device, iface):
             return
 
-        # --- Get device IP address ---
-        primary_ip = getattr(device, "primary_ip4", None)
-        if primary_ip is None:
-            self.logger.warning(
-                f"[PushConfigToDevice] Device {device.name} has no primary IPv4 address. "
-                f"Cannot establish SSH connection. Please configure a primary IP in Nautobot."
+        # Get the VLAN we're supposed to configure
+        # If not passed explicitly (only possible for the single interface),
+        # get it from the interface
+        iface_vlan = vlan if iface is interface and vlan is not None else None
+        if iface_vlan is None:
+            iface_vlan = getattr(iface, "untagged_vlan", None)
+
+        if iface_vlan is None:
+            # No VLAN to configure - nothing to do for this port
+            logger.info(
+                "[PushConfigToDevice] No VLAN configured on interface %s. "
+                "Nothing to push for it.",
+                iface.name,
             )
+            continue
+
+        # Pushed (or seen in a backup) a few minutes ago with this very VLAN?
+        # Then the device already has it - no SSH session for nothing (see _device_state.py)
+        if _device_state.has_vlan(device.pk, iface.name, iface_vlan.name):
+            logger.info(
+                "[PushConfigToDevice] Interface %s already has VLAN %s on the device. Skipping it.",
+                iface.name,
+                iface_vlan.name,
+            )
+            continue
+        targets.append(iface)
+
+    if not targets:
+        logger.info("[PushConfigToDevice] No interface left to change. Nothing to push to device.")
+        return
+
+    # --- Validate device platform ---
+    # This PoC only supports Juniper JunOS devices
+    # Checked before any template or credential work, so other platforms return at once
+    # (one cached query for platform, IP and secrets group, see _device_info.py)
+    driver = device_info(device).driver
+
+    if driver != "juniper_junos":
+        logger.info(
+            "[PushConfigToDevice] Device %s has network driver '%s', "
+            "not 'juniper_junos'. This PoC only supports Juniper devices. Skipping push.",
+            device.name,
+            driver,
+        )
+        return
+
+    # For the log lines below
+    iface_names = ", ".join(iface.name for iface in targets)
+
+    # --- Render the commands to send ---
+    # Per interface: a delete that removes any existing VLAN config (clean slate),
+    # then the "set" commands. Each delete only touches its own port and every port
+    # is in targets once, so no "set" is undone by a later delete.
+    if _USE_JINJA:
+        config_lines = _render_commands(logger, targets, iface_names)
+        if config_lines is None:
             return
+    else:
+        # Built-in emitter: the same lines as the shipped template, without Jinja
+        config_lines = [line for iface in targets for line in JunosSetEmitter.emit_push(iface)]
+
+    # Sanity check - make sure we actually have commands to send
+    if not config_lines:
+        logger.warning(
+            "[PushConfigToDevice] No configuration commands generated for interface(s) "
+            "%s. Template might be empty or misconfigured. Nothing to push.",
+            iface_names,
+        )
+        return
+
+    logger.info(
+        "[PushConfigToDevice] Prepared %s commands to send to "
+        "device %s for interface(s) %s:",
+        len(config_lines),
+        device.name,
+        iface_names,
+    )
+    # Log each command so we can see exactly what will be sent
+    # (the loop is skipped entirely when INFO isn't logged)
+    if logger.isEnabledFor(logging.INFO):
+        for i, cmd in enumerate(config_lines, 1):
+            logger.info("  Command %s: %s", i, cmd)
 
-        host = str(primary_ip.address.ip)  # Extract just the IP, not the subnet
+    return config_lines, iface_names, driver, targets
 
-        # --- Retrieve credentials ---
-        # Same logic as backup job - try Secrets Group first, then environment variables
-        username = None
-        password = None
 
-        # Try device's assigned Secrets Group (recommended approach)
-        secrets_group = getattr(device, "secrets_group", None)
-        
-        if secrets_group:
-            try:
-                username = secrets_group.get_secret_value(
-                    secret_type=SecretsGroupSecretTypeChoices.TYPE_USERNAME,
-                    access_type=SecretsGroupAccessTypeChoices.TYPE_GENERIC,
-                    obj=device,
-                )
-                password = secrets_group.get_secret_value(
-                    secret_type=SecretsGroupSecretTypeChoices.TYPE_PASSWORD,
-                    access_type=SecretsGroupAccessTypeChoices.TYPE_GENERIC,
-                    obj=device,
-                )
-                self.logger.info(
-                    f"[PushConfigToDevice] Retrieved credentials from SecretsGroup "
-                    f"'{secrets_group.name}' for device {device.name}."
-                )
-            except SecretError as e:
-                self.logger.error(
-                    f"[PushConfigToDevice] Failed to get credentials from SecretsGroup: {e}"
-                )
+def _nonblank_lines(chunks):
+    """
+    Yield the non-empty lines of streamed template output, stripped.
 
-        # Fallback to environment variables
-        if not username or not password:
-            env_user = os.environ.get("NETMIKO_USERNAME")
-            env_pass = os.environ.get("NETMIKO_PASSWORD")
-            
-            if env_user and env_pass:
-                username = env_user
-                password = env_pass
-                self.logger.info(
-                    "[PushConfigToDevice] Using fallback credentials from environment "
-                    "variables (NETMIKO_USERNAME and NETMIKO_PASSWORD)."
-                )
+    chunks is template.generate(...): the output arrives piece by piece and is
+    split into lines as it comes, so the full rendered text is never built.
+    (strip() also drops the \r of \r\n line endings)
+    """
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        if "\n" not in buf:
+            continue
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line
+    buf = buf.strip()
+    if buf:
+        yield buf
+
+
+def _render_commands(logger, targets, iface_names):
+    """Render the delete + "set" commands of targets with the Jinja2 template (None on failure)."""
+    # Locate the Git repository
+    # (resolved once per worker process, not on every run)
+    repo_root = PushConfigToDevice._repo_root().root
+    logger.info("[PushConfigToDevice] Using Git repository at: %s", repo_root)
+
+    # Find the template file
+    template_path = repo_root / PushConfigToDevice.TEMPLATE_REL_PATH
+    # (stat()ed at most every 30s, see _templates.py)
+    if not template_exists(template_path):
+        logger.error(
+            "[PushConfigToDevice] Template file not found at %s. "
+            "Cannot generate configuration commands. Please ensure template exists.",
+            template_path,
+        )
+        return None
+
+    try:
+        # Load the template through the shared Jinja2 environment (see _templates.py)
+        template = get_template(template_path)
+
+        # Render ONLY these specific interfaces
+        # The template exports a push_interface(i) macro (the delete line plus the
+        # loop body of the full config) - we call it directly: no loop, and nothing
+        # of the device-wide config around it ends up in the push. template.module
+        # is built once per compiled template.
+        # The macros emit clean output (one command per line, no blank lines or
+        # indentation - see the whitespace control in the template), so their lines
+        # are used as they are; a whole-template render is streamed and cleaned up.
+        # Older templates without push_interface get the delete lines added here.
+        module = template.module
+        push_interface = getattr(module, "push_interface", None)
+        render_interface = getattr(module, "render_interface", None)
+        if push_interface is not None:
+            config_lines = "".join([str(push_interface(iface)) for iface in targets]).splitlines()
+        elif render_interface is not None:
+            rendered = "".join([str(render_interface(iface)) for iface in targets])
+            config_lines = [*map(JunosSetEmitter.delete_line, targets), *rendered.splitlines()]
+        else:
+            config_lines = [
+                *map(JunosSetEmitter.delete_line, targets),
+                *_nonblank_lines(template.generate(interfaces=targets)),
+            ]
+
+        logger.info(
+            "[PushConfigToDevice] Rendered template for interface(s) %s. "
+            "Generated %s lines of configuration.",
+            iface_names,
+            len(config_lines),
+        )
 
-        # Final check - do we have credentials?
-        if not username or not password:
-            self.logger.error(
-                "[PushConfigToDevice] No credentials available. Tried: "
-                "1) Device SecretsGroup, 2) Environment variables. "
-                "Cannot push configuration without credentials."
-            )
-            return
+    except Exception as e:
+        logger.error(
+            "[PushConfigToDevice] Failed to render template %s: %s",
+            template_path,
+            e,
+        )
+        return None
+
+    return config_lines
 
-        # Build connection parameters for Netmiko
-        device_params = {
-            "device_type": driver,  # juniper_junos
-            "host": host,  # Device IP
-            "username": username,
-            "password": password,
-            "timeout": 30,  # Connection timeout
-            "banner_timeout": 15,  # Banner timeout
-        }
-
-        # --- Connect and push configuration ---
-        self.logger.info(
-            f"[PushConfigToDevice] Connecting to device {device.name} at {host} via SSH "
-            f"to push configuration for interface {interface.name}..."
+
+def _report_output(logger, device, iface_names, output):
+    """Log what the device answered and warn if it looks like an error (then returns False)."""
+    # Log the device's response
+    logger.info(
+        "[PushConfigToDevice] Device response:\n%s",
+        output,
+    )
+
+    # Check if there were any errors in the output
+    # Junos typically includes "error", "invalid" or "unknown command" in error messages
+    if _DEVICE_ERROR_RE.search(output):
+        logger.warning(
+            "[PushConfigToDevice] Device output contains 'error', 'invalid' or 'unknown command'. "
+            "Configuration might not have been applied successfully. "
+            "Please review the output above."
         )
+        _device_state.forget(device.pk)
+        return False
+
+    logger.info(
+        "[PushConfigToDevice] Successfully completed config push for device "
+        "%s, interface(s) %s.",
+        device.name,
+        iface_names,
+    )
+    return True
+
+
+class BulkPushConfigToDevices(Job):
+    """
+    Pushes the VLAN config of many interfaces, spread over several devices.
 
+    The interfaces are grouped by device: each device gets ONE do_push call with
+    all of its interfaces (one send_config_set), and the devices are pushed in
+    parallel threads - every push mostly waits on SSH.
+    """
+
+    class Meta:
+        name = "03_Bulk push config to devices (POC)"
+        description = "Push the VLAN config of several interfaces, one batch per device, devices in parallel."
+        commit_default = False
+
+    interfaces = MultiObjectVar(
+        model=Interface,
+        required=True,
+        description="Interfaces to push (grouped by their device).",
+    )
+
+    # How many devices we push to at the same time. Kept at 8: sshd's default
+    # MaxStartups (10) limits parallel logins per host, and a jump host or
+    # management network often sits in front of all devices.
+    MAX_WORKERS = 8
+
+    def run(self, interfaces, **kwargs):
+        """Push all selected interfaces (see do_push_many)."""
+        do_push_many(self.logger, interfaces, max_workers=self.MAX_WORKERS)
+
+
+def do_push_many(logger, interfaces, max_workers=BulkPushConfigToDevices.MAX_WORKERS):
+    """
+    Group interfaces by device and run one do_push per device, devices in parallel.
+
+    Args:
+        logger: Logger to write to (the calling job's self.logger)
+        interfaces: The Interface objects to push (any mix of devices)
+        max_workers: Upper limit of parallel threads
+
+    Returns:
+        Names of the devices that failed
+    """
+    # device pk -> (device, [interfaces]); one query for all devices and VLANs
+    batches = {}
+    for iface in Interface.objects.filter(pk__in=[i.pk for i in interfaces]).select_related(
+        "device", "untagged_vlan"
+    ):
+        batches.setdefault(iface.device_id, (iface.device, []))[1].append(iface)
+    if not batches:
+        return []
+
+    workers = max(1, min(max_workers, len(batches)))
+    if scrapli_enabled():
+        return _push_many_async(logger, batches.values(), workers)
+
+    # The pushes log from pool threads - bind the job's task id here, on the
+    # job's thread, or their lines (push errors!) never reach the JobResult
+    # (see _task_log.py)
+    logger = task_logger(logger)
+
+    logger.info(
+        "[PushConfigToDevice] Pushing %s interface(s) on %s device(s) with %s parallel worker(s).",
+        sum(len(batch) for _, batch in batches.values()),
+        len(batches),
+        workers,
+    )
+
+    def _push_one(device, batch):
         try:
-            # Use context manager to ensure connection cleanup
-            with ConnectHandler(**device_params) as conn:
-                self.logger.info(
-                    f"[PushConfigToDevice] Successfully connected. Sending {len(config_lines)} "
-                    f"configuration commands..."
-                )
-                
-                # Send all commands to the device
-                # send_config_set enters configuration mode, sends commands, and exits
-                output = conn.send_config_set(config_lines)
-                
-                # Log the device's response
-                self.logger.info(
-                    f"[PushConfigToDevice] Device response:\n{output}"
-                )
-                
-                # Check if there were any errors in the output
-                # Junos typically includes "error" or "invalid" in error messages
-                if "error" in output.lower() or "invalid" in output.lower():
-                    self.logger.warning(
-                        "[PushConfigToDevice] Device output contains 'error' or 'invalid'. "
-                        "Configuration might not have been applied successfully. "
-                        "Please review the output above."
-                    )
-                
-        except Exception as e:
-            # Connection or command execution failed
-            self.logger.error(
-                f"[PushConfigToDevice] Failed to push configuration to device "
-                f"{device.name} ({host}). Error: {e}"
-            )
-            return
+            do_push(logger, device, interfaces=batch)
+        finally:
+            # Django gives every thread its own DB connection - close ours when done
+            # (close_old_connections() would keep it open for CONN_MAX_AGE)
+            connection.close()
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-push") as executor:
+        futures = {executor.submit(_push_one, device, batch): device for device, batch in batches.values()}
+        for future in as_completed(futures):
+            device = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(device.name)
+                logger.error("[PushConfigToDevice] Push to %s failed: %s", device.name, e)
+    return failed
+
+
+def _push_many_async(logger, batches, max_concurrency):
+    """
+    do_push_many with PUSH_TRANSPORT=scrapli: render in this thread, send on one event loop.
+
+    Rendering and the credential lookup need the database, so they stay
+    synchronous (they are quick); only the SSH part runs concurrently.
+    """
+    to_send = []
+    names = {}
+    pushed = {}
+    for device, batch in batches:
+        prepared = prepare_push(logger, device, interfaces=batch)
+        if prepared is None:
+            continue
+        config_lines, iface_names, driver, targets = prepared
+        device_params = build_device_params(device, driver, logger, "[PushConfigToDevice]")
+        if device_params is None:
+            continue
+        to_send.append((device, device_params, config_lines))
+        names[device] = iface_names
+        pushed[device] = targets
+
+    if not to_send:
+        return []
+    logger.info(
+        "[PushConfigToDevice] Pushing %s device(s) via scrapli/asyncssh, at most %s at a time.",
+        len(to_send),
+        max_concurrency,
+    )
+
+    failed = []
+    results = send_many(to_send, max_concurrency, timeout=PushConfigToDevice.READ_TIMEOUT)
+    for device, output in results.items():
+        if isinstance(output, Exception):
+            failed.append(device.name)
+            logger.error("[PushConfigToDevice] Push to %s failed: %s", device.name, output)
+            _device_state.forget(device.pk)
+        elif _report_output(logger, device, names[device], output):
+            _remember_pushed(device, pushed[device])
+    return failed
 
-        self.logger.info(
-            f"[PushConfigToDevice] Successfully completed config push for device "
-            f"{device.name}, interface {interface.name}."
-        )
 
+# Register these jobs so Nautobot can discover and run them
+register_jobs(PushConfigToDevice, BulkPushConfigToDevices)
 
-# Register this job so Nautobot can discover and run it
-register_jobs(PushConfigToDevice)
+# Compile the template now (in the background) instead of on the first push
+if _USE_JINJA:
+    warm_up(PushConfigToDevice._repo_root().root / PushConfigToDevice.TEMPLATE_REL_PATH)
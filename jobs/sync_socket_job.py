@@ -5,18 +5,22 @@
 # 
 # How it works:
 # - Triggers whenever an Interface object is updated in Nautobot
+# - Stops right away if the update didn't touch the untagged VLAN
 # - Checks if the interface is part of a Socket<->Switch connection
 # - Syncs the untagged VLAN in both directions (bidirectional sync)
-# - Only triggers the config pipeline if something actually changed
+# - Only triggers the config pipeline if the Switch port's VLAN changed
+# - Ignores the hook fired by its own save of the peer interface (see SELF_SAVE_KEY)
 # 
 # Why we need this:
 # When a customer changes their socket VLAN, we want the switch port to match automatically.
 # This ensures the source of truth (Nautobot) stays consistent before we push config.
 
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from nautobot.apps.jobs import JobHookReceiver, register_jobs
 from nautobot.dcim.models import Interface
 
-from .config_pipeline_job import ConfigPipeline
+from .config_pipeline_job import run_coalesced
 
 # This groups all related jobs together in the Nautobot UI
 name = "00_Vlan-Change-Jobs"
@@ -41,6 +45,58 @@ class SyncSocketVlanToSwitch(JobHookReceiver):
         # This job modifies the database (saves interfaces), so we commit by default
         commit_default = True
 
+    # Saving the peer interface fires this hook again (in another job run, maybe on
+    # another worker). Before that save we put a marker into Nautobot's cache (Redis);
+    # the hook run that finds it knows the change came from us and stops right away.
+    SELF_SAVE_KEY = "syncsocket:self-save:{pk}"
+    SELF_SAVE_TTL = 120  # Seconds - the hook run normally follows within seconds
+
+    # The only columns our save writes: the VLAN, plus the auto_now timestamp
+    # (with update_fields, Django only refreshes last_updated if it's listed)
+    SAVE_FIELDS = ["untagged_vlan", "last_updated"]
+
+    @staticmethod
+    def _untagged_vlan_changed(change):
+        """
+        False if the ObjectChange shows the untagged VLAN was NOT modified, else True.
+
+        Uses the pre/post snapshots Nautobot keeps for the change. If they can't be
+        compared (e.g. no earlier snapshot), we assume it might have changed.
+        """
+        try:
+            differences = change.get_snapshots().get("differences") or {}
+        except Exception:
+            return True
+        if not differences:
+            return True
+        changed_fields = set(differences.get("added") or {}) | set(differences.get("removed") or {})
+        return "untagged_vlan" in changed_fields
+
+    @staticmethod
+    def _connected_endpoint(endpoint):
+        """
+        What endpoint is cabled to - like endpoint.connected_endpoint, with fewer queries.
+
+        connected_endpoint is endpoint._path.destination, a generic foreign key that
+        select_related can't follow. When the path ends on an Interface we load it
+        ourselves, with its device and role in the same query (they're read next).
+        Works for the changed interface and for a non-Interface first peer alike;
+        objects without a cable path have nothing connected.
+        """
+        path = getattr(endpoint, "_path", None)
+        if path is None:
+            return None
+        # get_for_model is cached by Django - no query after the first call
+        if path.destination_type_id == ContentType.objects.get_for_model(Interface).pk:
+            return Interface.objects.select_related("device__role").filter(pk=path.destination_id).first()
+        return endpoint.connected_endpoint
+
+    def _save_synced(self, iface):
+        """Save an interface we changed, marking the save as our own (see SELF_SAVE_KEY)."""
+        cache.set(self.SELF_SAVE_KEY.format(pk=iface.pk), iface.untagged_vlan_id, self.SELF_SAVE_TTL)
+        # UPDATE of just these columns - concurrent edits to other fields are kept
+        iface.save(update_fields=self.SAVE_FIELDS)
+
     def receive_job_hook(self, change, action, changed_object):
         """
         Main entry point - called automatically when any model object changes.
@@ -55,7 +111,8 @@ class SyncSocketVlanToSwitch(JobHookReceiver):
         # Creates don't have a previous state to compare, deletes are being removed anyway
         if action != "update":
             self.logger.debug(
-                f"[SyncSocketVlanToSwitch] Ignoring action '{action}' - we only handle 'update' actions."
+                "[SyncSocketVlanToSwitch] Ignoring action '%s' - we only handle 'update' actions.",
+                action,
             )
             return
 
@@ -63,14 +120,39 @@ class SyncSocketVlanToSwitch(JobHookReceiver):
         # JobHooks can be triggered by any model, so we need to filter
         if not isinstance(changed_object, Interface):
             self.logger.debug(
-                f"[SyncSocketVlanToSwitch] Changed object is not an Interface "
-                f"(got {type(changed_object).__name__}), skipping this hook."
+                "[SyncSocketVlanToSwitch] Changed object is not an Interface "
+                "(got %s), skipping this hook.",
+                type(changed_object).__name__,
             )
             return
 
         # Now we know it's an Interface update, let's work with it
         iface: Interface = changed_object
 
+        # Description, enable/disable, ... - nothing for us to sync. Checked before
+        # we walk device, role and cable path (several queries per interface save)
+        if not self._untagged_vlan_changed(change):
+            self.logger.debug(
+                "[SyncSocketVlanToSwitch] Update of %s didn't change the untagged VLAN, skipping.",
+                iface,
+            )
+            return
+
+        # Is this the hook for our own save of the peer? Then both sides are already
+        # in sync and the pipeline was triggered by the run that saved it.
+        # (cache.delete is True only if the marker existed - each marker is used once)
+        key = self.SELF_SAVE_KEY.format(pk=iface.pk)
+        if cache.get(key) == iface.untagged_vlan_id and cache.delete(key):
+            self.logger.debug(
+                "[SyncSocketVlanToSwitch] Update of %s was made by this sync job itself, skipping.",
+                iface,
+            )
+            return
+
+        # Load the interface again with its device, role, VLAN and cable path in ONE
+        # query (walking them one attribute at a time costs a query each)
+        iface = Interface.objects.select_related("device__role", "untagged_vlan", "_path").get(pk=iface.pk)
+
         # Get the device that owns this interface
         # We need this to check the device role (Socket vs Switch vs something else)
         device = getattr(iface, "device", None)
@@ -79,13 +161,15 @@ class SyncSocketVlanToSwitch(JobHookReceiver):
 
         # Find out what this interface is connected to
         # In Nautobot, interfaces can be cabled to other interfaces, patch panels, etc.
-        peer = getattr(iface, "connected_endpoint", None)
+        # (an Interface peer comes with its device and role, see _connected_endpoint)
+        peer = self._connected_endpoint(iface)
         
         if peer is None:
             # No cable connection = nothing to sync
-            self.logger.info(
-                f"[SyncSocketVlanToSwitch] Interface {iface} has no cable connection, "
-                f"nothing to synchronize."
+            self.logger.debug(
+                "[SyncSocketVlanToSwitch] Interface %s has no cable connection, "
+                "nothing to synchronize.",
+                iface,
             )
             return
 
@@ -95,24 +179,29 @@ class SyncSocketVlanToSwitch(JobHookReceiver):
         # So we need to "hop" one more time to find the actual Switch interface
         if not isinstance(peer, Interface):
             self.logger.debug(
-                f"[SyncSocketVlanToSwitch] First peer of {iface} is a {type(peer).__name__}, "
-                f"not an Interface. Checking if there's a second hop..."
+                "[SyncSocketVlanToSwitch] First peer of %s is a %s, "
+                "not an Interface. Checking if there's a second hop...",
+                iface,
+                type(peer).__name__,
             )
             
             # Try to get the second-hop connection
-            peer2 = getattr(peer, "connected_endpoint", None)
+            # (an Interface comes with its device and role, see _connected_endpoint)
+            peer2 = self._connected_endpoint(peer)
             
             if isinstance(peer2, Interface):
                 # Found an Interface on the other side of the patch panel
                 self.logger.debug(
-                    f"[SyncSocketVlanToSwitch] Second-hop peer is {peer2} (an Interface), using that."
+                    "[SyncSocketVlanToSwitch] Second-hop peer is %s (an Interface), using that.",
+                    peer2,
                 )
                 peer = peer2
             else:
                 # Even the second hop isn't an Interface, can't sync
-                self.logger.info(
-                    f"[SyncSocketVlanToSwitch] Second-hop peer is also not an Interface, "
-                    f"cannot sync (got {type(peer2).__name__ if peer2 else 'None'})."
+                self.logger.debug(
+                    "[SyncSocketVlanToSwitch] Second-hop peer is also not an Interface, "
+                    "cannot sync (got %s).",
+                    type(peer2).__name__ if peer2 else "None",
                 )
                 return
 
@@ -138,10 +227,14 @@ class SyncSocketVlanToSwitch(JobHookReceiver):
             direction = "Switch -> Socket"
         else:
             # Neither is a Socket, or both are Sockets - not a valid Socket<->Switch pair
-            self.logger.info(
-                f"[SyncSocketVlanToSwitch] Interface {iface} (role={role_name}) and "
-                f"peer {peer} (role={peer_role_name}) do not form a Socket<->Switch pair. "
-                f"Skipping sync."
+            self.logger.debug(
+                "[SyncSocketVlanToSwitch] Interface %s (role=%s) and "
+                "peer %s (role=%s) do not form a Socket<->Switch pair. "
+                "Skipping sync.",
+                iface,
+                role_name,
+                peer,
+                peer_role_name,
             )
             return
 
@@ -152,79 +245,79 @@ class SyncSocketVlanToSwitch(JobHookReceiver):
         
         if new_vlan is None:
             # No VLAN set on the source interface, nothing to sync
-            self.logger.info(
-                f"[SyncSocketVlanToSwitch] Source interface {source} (in direction {direction}) "
-                f"has no untagged VLAN assigned, nothing to synchronize."
+            self.logger.debug(
+                "[SyncSocketVlanToSwitch] Source interface %s (in direction %s) "
+                "has no untagged VLAN assigned, nothing to synchronize.",
+                source,
+                direction,
             )
             return
 
+        # The source already has new_vlan (we just read it from there), so only
+        # the other side of the pair can need an update
+        target = switch_iface if source is socket_iface else socket_iface
+        target_side = "Switch" if target is switch_iface else "Socket"
+
         # Track if we actually made any changes
         # We only want to trigger the pipeline if something changed
-        changes_made = False
-
-        # Sync to the Socket side
-        # Check if the Socket already has the correct VLAN
-        if getattr(socket_iface, "untagged_vlan_id", None) != new_vlan.id:
-            # VLANs don't match, update the Socket
-            self.logger.info(
-                f"[SyncSocketVlanToSwitch] {direction}: Setting untagged VLAN on Socket "
-                f"{socket_iface} to VLAN {new_vlan} (synced from {source})."
-            )
-            socket_iface.untagged_vlan = new_vlan
-            socket_iface.save()
-            changes_made = True
-        else:
-            # Socket already has the correct VLAN
-            self.logger.info(
-                f"[SyncSocketVlanToSwitch] Socket {socket_iface} already has VLAN {new_vlan}, "
-                f"no update needed on Socket side."
-            )
+        changes_made = getattr(target, "untagged_vlan_id", None) != new_vlan.id
 
-        # Sync to the Switch side
-        # Check if the Switch already has the correct VLAN
-        if getattr(switch_iface, "untagged_vlan_id", None) != new_vlan.id:
-            # VLANs don't match, update the Switch
+        if changes_made:
+            # VLANs don't match, update the other side
             self.logger.info(
-                f"[SyncSocketVlanToSwitch] {direction}: Setting untagged VLAN on Switch "
-                f"{switch_iface} to VLAN {new_vlan} (synced from {source})."
+                "[SyncSocketVlanToSwitch] %s: Setting untagged VLAN on %s "
+                "%s to VLAN %s (synced from %s).",
+                direction,
+                target_side,
+                target,
+                new_vlan,
+                source,
             )
-            switch_iface.untagged_vlan = new_vlan
-            switch_iface.save()
-            changes_made = True
+            target.untagged_vlan = new_vlan
+            self._save_synced(target)
         else:
-            # Switch already has the correct VLAN
-            self.logger.info(
-                f"[SyncSocketVlanToSwitch] Switch {switch_iface} already has VLAN {new_vlan}, "
-                f"no update needed on Switch side."
+            # The other side already has the correct VLAN
+            self.logger.debug(
+                "[SyncSocketVlanToSwitch] %s %s already has VLAN %s, "
+                "no update needed on %s side.",
+                target_side,
+                target,
+                new_vlan,
+                target_side,
             )
 
-        # Check if we actually changed anything
-        if not changes_made:
-            # Both interfaces already had the correct VLAN, nothing to do
-            self.logger.info(
-                f"[SyncSocketVlanToSwitch] Both Socket {socket_iface} and Switch {switch_iface} "
-                f"already had the correct VLAN. Source of truth is in sync, not triggering pipeline."
+        # Only the switch port has a device config - does it have a new VLAN?
+        # - Switch was edited (source): yes, whether or not the Socket needed an update
+        # - Socket was edited: only if we just changed the Switch above
+        switch_changed = source is switch_iface or changes_made
+        if not switch_changed:
+            self.logger.debug(
+                "[SyncSocketVlanToSwitch] Switch %s already had VLAN %s. "
+                "Nothing changed on the switch, not triggering pipeline.",
+                switch_iface,
+                new_vlan,
             )
             return
 
-        # We made changes to the source of truth (Nautobot)
+        # The switch port's VLAN changed in the source of truth (Nautobot)
         # Now trigger the pipeline to backup, render intended config, and push to the device
         self.logger.info(
-            f"[SyncSocketVlanToSwitch] Successfully synced VLAN {new_vlan} between "
-            f"Socket {socket_iface} and Switch {switch_iface}. Triggering ConfigPipeline "
-            f"to push changes to the physical device."
+            "[SyncSocketVlanToSwitch] VLAN %s is in sync between "
+            "Socket %s and Switch %s. Triggering ConfigPipeline "
+            "to push changes to the physical device.",
+            new_vlan,
+            socket_iface,
+            switch_iface,
         )
 
-        # Create an instance of the pipeline job
-        pipeline_job = ConfigPipeline()
-        
-        # Share our logger so all pipeline logs appear in the same place
-        pipeline_job.logger = self.logger
-        
         # Run the pipeline with the switch device/interface and VLAN info
         # We pass the switch interface because that's what needs to be configured on the device
-        pipeline_job.run(
-            device=switch_iface.device,
+        # Our logger is passed along so all pipeline logs appear in the same place.
+        # run_coalesced: if a run for this switch is already in progress (rapid edits),
+        # it just picks up our port afterwards instead of us starting another run
+        run_coalesced(
+            self.logger,
+            switch_iface.device,
             interface=switch_iface,
             vlan=new_vlan,
         )